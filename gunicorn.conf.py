@@ -0,0 +1,51 @@
+# Multi-worker serving for the ClimaGuard API.
+#
+#   gunicorn -c gunicorn.conf.py src.service:app
+#
+# The app and its models are loaded once in the master and workers are forked
+# from it, so model memory is shared copy-on-write instead of duplicated per
+# worker. When models/VERSION changes the master loads the new models and
+# replaces the workers gracefully, so the new version is shared the same way.
+import os
+import signal
+import threading
+import time
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", 16))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = 60
+
+
+def watch_model_version(server):
+    from src import service
+
+    while True:
+        time.sleep(service.model_reload_check_seconds)
+        try:
+            version = service.read_model_version()
+            if version is None or version == service.models.get('version'):
+                continue
+            service.preload_models()
+            server.log.info("Loaded models (version %s), replacing workers", version)
+            # With preload_app a HUP re-forks workers from the master without
+            # re-importing the app, then retires the old ones
+            os.kill(os.getpid(), signal.SIGHUP)
+        except Exception as e:
+            server.log.warning("Model reload failed: %s", e)
+
+
+def when_ready(server):
+    # Runs in the master after the app is imported and before any worker is forked
+    from src import service
+
+    try:
+        service.preload_models()
+        server.log.info("Preloaded models (version %s)", service.models.get('version'))
+    except Exception as e:
+        server.log.warning("Could not preload models, workers will load their own: %s", e)
+
+    # Started either way: once a model is trained the master loads it and replaces
+    # the workers, so they share it from then on
+    threading.Thread(target=watch_model_version, args=(server,), daemon=True).start()
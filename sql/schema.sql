@@ -20,9 +20,15 @@ CREATE TABLE IF NOT EXISTS weather_raw (
     o3 FLOAT,
     so2 FLOAT,
     nh3 FLOAT,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY unique_city_ts (city, ts)
 );
 
+-- Existing databases: drop duplicate readings, then add the key
+-- DELETE r1 FROM weather_raw r1 JOIN weather_raw r2
+--     ON r1.city = r2.city AND r1.ts = r2.ts AND r1.id > r2.id;
+-- ALTER TABLE weather_raw ADD UNIQUE KEY unique_city_ts (city, ts);
+
 CREATE TABLE IF NOT EXISTS weather_daily(
     id INT AUTO_INCREMENT PRIMARY KEY,
     city VARCHAR(100) DEFAULT 'Toronto',
@@ -33,10 +39,33 @@ CREATE TABLE IF NOT EXISTS weather_daily(
     humidity FLOAT,
     wind_chill FLOAT,
     mean_aqi FLOAT,
+    min_temp_3d FLOAT,
+    min_temp_7d FLOAT,
+    aqi_delta_1d FLOAT,
+    avg_temp_delta_1d FLOAT,
+    cold_day_streak INT,
     risk_level VARCHAR(20),
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY unique_city_date (city, date),
+    KEY idx_created_at (created_at)
 );
 
+-- Existing databases: index the column the API feature store polls for new rows
+-- ALTER TABLE weather_daily ADD KEY idx_created_at (created_at);
+
+-- Existing databases: drop duplicate days, then add the key (required by backfill.py upserts)
+-- DELETE d1 FROM weather_daily d1 JOIN weather_daily d2
+--     ON d1.city = d2.city AND d1.date = d2.date AND d1.id < d2.id;
+-- ALTER TABLE weather_daily ADD UNIQUE KEY unique_city_date (city, date);
+
+-- Existing databases: add the rolling/lag feature columns
+-- ALTER TABLE weather_daily
+--     ADD COLUMN min_temp_3d FLOAT AFTER mean_aqi,
+--     ADD COLUMN min_temp_7d FLOAT AFTER min_temp_3d,
+--     ADD COLUMN aqi_delta_1d FLOAT AFTER min_temp_7d,
+--     ADD COLUMN avg_temp_delta_1d FLOAT AFTER aqi_delta_1d,
+--     ADD COLUMN cold_day_streak INT AFTER avg_temp_delta_1d;
+
 CREATE TABLE IF NOT EXISTS predictions(
     id INT AUTO_INCREMENT PRIMARY KEY,
     city VARCHAR(100),
@@ -45,4 +74,11 @@ CREATE TABLE IF NOT EXISTS predictions(
     confidence FLOAT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     UNIQUE KEY unique_city_date (city, date)
+);
+
+CREATE TABLE IF NOT EXISTS city_locations(
+    city VARCHAR(100) PRIMARY KEY,
+    lat DOUBLE NOT NULL,
+    lon DOUBLE NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
 );
\ No newline at end of file
@@ -0,0 +1,189 @@
+import argparse
+import json
+import os
+import time
+from datetime import date, timedelta
+from multiprocessing import Pool
+
+import pandas as pd
+from sqlalchemy import create_engine, text
+from dotenv import dotenv_values
+
+try:
+    from src.features import (BASE_FEATURES, ROLLING_FEATURES, WINDOW_DAYS, build_daily_features,
+                              add_rolling_features, upsert_daily_features)
+except ImportError:
+    from features import (BASE_FEATURES, ROLLING_FEATURES, WINDOW_DAYS, build_daily_features,
+                          add_rolling_features, upsert_daily_features)
+
+env = dotenv_values(".env")
+
+if not env:
+    raise ValueError(".env file not found! Please create a .env file based on env.example.")
+
+db_user = env.get("DB_USER")
+db_password = env.get("DB_PASSWORD")
+db_host = env.get("DB_HOST")
+db_name = env.get("DB_NAME")
+
+# Each worker holds its own engine; connections must not cross the fork
+_worker_engine = None
+
+
+def create_db_engine():
+    if not all([db_user, db_password, db_host, db_name]):
+        raise ValueError("Database credentials are required. Set DB_USER, DB_PASSWORD, DB_HOST, DB_NAME in .env")
+    return create_engine(f"mysql+mysqlconnector://{db_user}:{db_password}@{db_host}/{db_name}")
+
+
+def _init_worker():
+    global _worker_engine
+    _worker_engine = create_db_engine()
+
+
+def load_checkpoint(path, params):
+    # Progress only carries over to a run with the same parameters
+    if os.path.exists(path):
+        with open(path) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('params') == params:
+            return checkpoint
+        print(f"Ignoring {path}: it was written by a run with different parameters")
+    return {'params': params, 'aggregated': [], 'rolled': []}
+
+
+def save_checkpoint(checkpoint, path):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def month_bounds(month):
+    start = date.fromisoformat(f"{month}-01")
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start, end
+
+
+def list_partitions(engine, start_month=None, end_month=None, cities=None):
+    query = """
+        SELECT city, DATE_FORMAT(ts, '%Y-%m') AS month, COUNT(*) AS n
+        FROM weather_raw
+        WHERE city IS NOT NULL
+    """
+    params = {}
+    if start_month:
+        query += " AND ts >= :start"
+        params['start'] = month_bounds(start_month)[0]
+    if end_month:
+        query += " AND ts < :end"
+        params['end'] = month_bounds(end_month)[1]
+    query += " GROUP BY city, month ORDER BY city, month"
+
+    partitions = pd.read_sql(text(query), engine, params=params)
+    if cities:
+        partitions = partitions[partitions['city'].isin(cities)]
+    return list(partitions[['city', 'month']].itertuples(index=False, name=None))
+
+
+def aggregate_partition(partition):
+    # One (city, month) of raw readings -> upserted daily base features and risk labels
+    city, month = partition
+    start, end = month_bounds(month)
+    started = time.perf_counter()
+
+    weather_df = pd.read_sql(text("""
+        SELECT * FROM weather_raw
+        WHERE city = :city AND ts >= :start AND ts < :end
+    """), _worker_engine, params={'city': city, 'start': start, 'end': end})
+
+    daily_features = build_daily_features(weather_df)
+    count = upsert_daily_features(daily_features, _worker_engine, BASE_FEATURES + ['risk_level'])
+    return partition, count, time.perf_counter() - started
+
+
+def roll_city(job):
+    # Recompute rolling/lag features for one city from start through its last stored
+    # day, seeded from the WINDOW_DAYS stored before start so streaks and windows
+    # continue correctly. Days after the backfilled range are rolled too, since their
+    # windows and streaks depend on the rewritten days.
+    city, start = job
+    started = time.perf_counter()
+
+    daily = pd.read_sql(text(f"""
+        SELECT city, date, {', '.join(BASE_FEATURES)}, cold_day_streak
+        FROM weather_daily
+        WHERE city = :city AND date >= :window_start
+        ORDER BY date
+    """), _worker_engine, params={
+        'city': city,
+        'window_start': start - timedelta(days=WINDOW_DAYS)
+    })
+    if daily.empty:
+        return city, 0, time.perf_counter() - started
+
+    daily['date'] = pd.to_datetime(daily['date']).dt.date
+    daily = daily.drop_duplicates(['city', 'date'], keep='last')
+    state = daily[daily['date'] < start]
+    target = daily[daily['date'] >= start].drop(columns='cold_day_streak')
+
+    rolled = add_rolling_features(target, state)
+    count = upsert_daily_features(rolled, _worker_engine, ROLLING_FEATURES)
+    return city, count, time.perf_counter() - started
+
+
+def run_backfill(start_month=None, end_month=None, cities=None, n_workers=None,
+                 checkpoint_path="backfill_checkpoint.json", reset=False, max_tasks_per_child=50):
+    engine = create_db_engine()
+
+    if reset and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    params = {'start': start_month, 'end': end_month, 'cities': sorted(cities) if cities else None}
+    checkpoint = load_checkpoint(checkpoint_path, params)
+    done = {tuple(p) for p in checkpoint['aggregated']}
+
+    partitions = list_partitions(engine, start_month, end_month, cities)
+    pending = [p for p in partitions if p not in done]
+    print(f"Backfill: {len(partitions)} (city, month) partitions, {len(pending)} pending")
+
+    if not partitions:
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        return True
+
+    # Workers are recycled after max_tasks_per_child partitions to keep memory bounded
+    with Pool(n_workers, initializer=_init_worker, maxtasksperchild=max_tasks_per_child) as pool:
+        for i, (partition, count, elapsed) in enumerate(pool.imap_unordered(aggregate_partition, pending), 1):
+            checkpoint['aggregated'].append(list(partition))
+            save_checkpoint(checkpoint, checkpoint_path)
+            print(f"[{i}/{len(pending)}] {partition[0]} {partition[1]}: {count} days in {elapsed:.2f}s")
+
+        # Rolling features need each city's days in order, so this pass is per city
+        start = month_bounds(min(month for _, month in partitions))[0]
+        rolled = set(checkpoint['rolled'])
+        city_jobs = [(city, start) for city in sorted({city for city, _ in partitions}) if city not in rolled]
+
+        for i, (city, count, elapsed) in enumerate(pool.imap_unordered(roll_city, city_jobs), 1):
+            checkpoint['rolled'].append(city)
+            save_checkpoint(checkpoint, checkpoint_path)
+            print(f"[{i}/{len(city_jobs)}] rolling features for {city}: {count} days in {elapsed:.2f}s")
+
+    # A finished run leaves nothing to resume; a rerun (e.g. after changing the
+    # risk thresholds) starts over
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    print("Backfill completed successfully!")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompute weather_daily from weather_raw in parallel")
+    parser.add_argument("--start", help="First month to backfill (YYYY-MM)")
+    parser.add_argument("--end", help="Last month to backfill (YYYY-MM)")
+    parser.add_argument("--cities", nargs="+", help="Only backfill these cities")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--checkpoint", default="backfill_checkpoint.json", help="Progress file used to resume")
+    parser.add_argument("--reset", action="store_true", help="Ignore previous progress and start over")
+    args = parser.parse_args()
+
+    run_backfill(args.start, args.end, args.cities, args.workers, args.checkpoint, args.reset)
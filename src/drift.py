@@ -0,0 +1,300 @@
+import fcntl
+import json
+import math
+import os
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import numpy as np
+
+# Raw reading fields tracked during ingest; daily features are tracked by name
+RAW_FIELDS = ['temp_c', 'min_temp_c', 'max_temp_c', 'wind_speed', 'humidity', 'pressure', 'aqi', 'pm25', 'pm10']
+
+
+# Mergeable quantile sketch with bounded relative error (DDSketch-style log buckets).
+# Memory is capped at max_buckets regardless of how many values are added.
+class QuantileSketch:
+    def __init__(self, relative_accuracy=0.01, max_buckets=2048):
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def _index(self, magnitude):
+        return int(math.ceil(math.log(magnitude) / self._log_gamma))
+
+    def _value(self, index):
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def add(self, value):
+        if abs(value) < 1e-9:
+            self.zero_count += 1
+        elif value > 0:
+            index = self._index(value)
+            self.positive[index] = self.positive.get(index, 0) + 1
+        else:
+            index = self._index(-value)
+            self.negative[index] = self.negative.get(index, 0) + 1
+        self.count += 1
+        self._collapse()
+
+    def merge(self, other):
+        for index, n in other.positive.items():
+            self.positive[index] = self.positive.get(index, 0) + n
+        for index, n in other.negative.items():
+            self.negative[index] = self.negative.get(index, 0) + n
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self._collapse()
+
+    def _collapse(self):
+        # Fold the smallest-magnitude buckets together; extreme quantiles stay accurate
+        while len(self.positive) + len(self.negative) > self.max_buckets:
+            store = self.positive if len(self.positive) >= len(self.negative) else self.negative
+            lowest, second = sorted(store)[:2]
+            store[second] += store.pop(lowest)
+
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                return -self._value(index)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return self._value(index)
+        return self._value(max(self.positive)) if self.positive else 0.0
+
+    def to_dict(self):
+        return {
+            'relative_accuracy': self.relative_accuracy,
+            'max_buckets': self.max_buckets,
+            'positive': {str(k): v for k, v in self.positive.items()},
+            'negative': {str(k): v for k, v in self.negative.items()},
+            'zero_count': self.zero_count,
+            'count': self.count
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['relative_accuracy'], data['max_buckets'])
+        sketch.positive = {int(k): v for k, v in data['positive'].items()}
+        sketch.negative = {int(k): v for k, v in data['negative'].items()}
+        sketch.zero_count = data['zero_count']
+        sketch.count = data['count']
+        return sketch
+
+
+# Constant-memory running statistics for one feature: null rate, mean/variance
+# (Welford, merged with Chan's formula), range and a quantile sketch.
+class FeatureStats:
+    def __init__(self):
+        self.count = 0
+        self.null_count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.sketch = QuantileSketch()
+
+    def add(self, value):
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            self.null_count += 1
+            return
+        value = float(value)
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.sketch.add(value)
+
+    def merge(self, other):
+        if other.count:
+            total = self.count + other.count
+            delta = other.mean - self.mean
+            self.mean += delta * other.count / total
+            self.m2 += other.m2 + delta * delta * self.count * other.count / total
+            self.count = total
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+            self.sketch.merge(other.sketch)
+        self.null_count += other.null_count
+
+    def summary(self):
+        total = self.count + self.null_count
+        return {
+            'count': self.count,
+            'null_rate': self.null_count / total if total else None,
+            'mean': self.mean if self.count else None,
+            'std': math.sqrt(self.m2 / self.count) if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p10': self.sketch.quantile(0.1),
+            'p50': self.sketch.quantile(0.5),
+            'p90': self.sketch.quantile(0.9)
+        }
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'null_count': self.null_count,
+            'mean': self.mean,
+            'm2': self.m2,
+            'min': self.min,
+            'max': self.max,
+            'sketch': self.sketch.to_dict()
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.count = data['count']
+        stats.null_count = data['null_count']
+        stats.mean = data['mean']
+        stats.m2 = data['m2']
+        stats.min = data['min']
+        stats.max = data['max']
+        stats.sketch = QuantileSketch.from_dict(data['sketch'])
+        return stats
+
+
+def collect_stats(rows, fields):
+    stats = {field: FeatureStats() for field in fields}
+    for row in rows:
+        for field in fields:
+            stats[field].add(row.get(field))
+    return stats
+
+
+def merge_stats(target, source):
+    for field, stats in source.items():
+        target.setdefault(field, FeatureStats()).merge(stats)
+    return target
+
+
+def stats_to_dict(stats):
+    return {field: s.to_dict() for field, s in stats.items()}
+
+
+def stats_from_dict(data):
+    return {field: FeatureStats.from_dict(s) for field, s in data.items()}
+
+
+def write_json_atomic(data, path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def locked(path):
+    # Exclusive lock on a sidecar file, held across a read-modify-write of path.
+    # Concurrent ingest/features processes would otherwise lose each other's updates.
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(f"{path}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def record_stats(path, rows, fields, window_days=7, day=None):
+    # Merge new rows into today's window of the stats file and drop windows older
+    # than window_days. Cost depends on the new rows and the bounded file only.
+    day = (day or date.today()).isoformat()
+    new_stats = collect_stats(rows, fields)
+
+    with locked(path):
+        windows = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                windows = json.load(f).get('windows', {})
+
+        current = stats_from_dict(windows.get(day, {}))
+        merge_stats(current, new_stats)
+        windows[day] = stats_to_dict(current)
+
+        cutoff = (date.fromisoformat(day) - timedelta(days=window_days - 1)).isoformat()
+        windows = {d: w for d, w in windows.items() if d >= cutoff}
+        write_json_atomic({'windows': windows}, path)
+
+
+def load_window_stats(path):
+    # All retained windows merged into one set of statistics
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        windows = json.load(f).get('windows', {})
+    merged = {}
+    for window in windows.values():
+        merge_stats(merged, stats_from_dict(window))
+    return merged
+
+
+def load_snapshot(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return stats_from_dict(json.load(f))
+
+
+def snapshot_frame(df, fields):
+    # Reference statistics for a training frame, in the same form as the live stats
+    stats = {}
+    for field in fields:
+        field_stats = FeatureStats()
+        for value in df[field].to_numpy(dtype=float):
+            field_stats.add(None if np.isnan(value) else value)
+        stats[field] = field_stats
+    return stats
+
+
+def compare_stats(live, reference, shift_threshold=0.5, null_rate_threshold=0.05):
+    # Shifts are expressed in training standard deviations
+    report = {}
+    for field, ref_stats in reference.items():
+        live_stats = live.get(field)
+        ref = ref_stats.summary()
+        if live_stats is None or live_stats.count == 0:
+            report[field] = {'live': None, 'reference': ref, 'drifted': None}
+            continue
+
+        cur = live_stats.summary()
+        scale = ref['std'] or 1.0
+        shifts = {
+            key: (cur[key] - ref[key]) / scale
+            for key in ['mean', 'p10', 'p50', 'p90']
+            if cur[key] is not None and ref[key] is not None
+        }
+        null_rate_delta = (cur['null_rate'] or 0.0) - (ref['null_rate'] or 0.0)
+        report[field] = {
+            'live': cur,
+            'reference': ref,
+            'shift': shifts,
+            'null_rate_delta': null_rate_delta,
+            'drifted': bool(
+                any(abs(v) > shift_threshold for v in shifts.values())
+                or null_rate_delta > null_rate_threshold
+            )
+        }
+    return report
@@ -1,15 +1,44 @@
 import joblib
 import numpy as np
 import pandas as pd
-import shap
+import xgboost as xgb
 import os
 
+try:
+    from src import profiling
+except ImportError:
+    import profiling
+
+
+MODEL_FILES = {
+    'xgboost': 'xgboost.joblib',
+    'logistic': 'logistic_regression.joblib'
+}
+
+# Loaded artifacts keyed by (model_type, model_dir), invalidated when the model version changes
+_artifact_cache = {}
+
+
+def artifact_version(model_path, model_dir):
+    # train.py writes models/VERSION after all artifacts; fall back to the model file's mtime
+    version_path = os.path.join(model_dir, "VERSION")
+    if os.path.exists(version_path):
+        with open(version_path) as f:
+            return f.read().strip()
+    return os.path.getmtime(model_path)
+
 
 def load_model_and_artifacts(model_type="xgboost", model_dir="models"):
-    model_path = os.path.join(model_dir, f"{model_type}.joblib")
+    model_path = os.path.join(model_dir, MODEL_FILES.get(model_type, f"{model_type}.joblib"))
     if not os.path.exists(model_path):
         raise FileNotFoundError(f"Model not found: {model_path}. Run train.py first.")
     
+    cache_key = (model_type, os.path.abspath(model_dir))
+    version = artifact_version(model_path, model_dir)
+    cached = _artifact_cache.get(cache_key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    
     model = joblib.load(model_path)
     
     scaler = None
@@ -29,86 +58,159 @@ def load_model_and_artifacts(model_type="xgboost", model_dir="models"):
     else:
         feature_names = joblib.load(feature_names_path)
     
-    return model, scaler, risk_mapping, feature_names
+    artifacts = (model, scaler, risk_mapping, feature_names)
+    _artifact_cache[cache_key] = (version, artifacts)
+    return artifacts
 
 
-def explain_prediction(features, model_type="xgboost", model_dir="models", top_n=3):
-    try:
-        model, scaler, risk_mapping, feature_names = load_model_and_artifacts(model_type, model_dir)
-        
+def to_feature_matrix(features_list, feature_names):
+    rows = []
+    for features in features_list:
         if isinstance(features, dict):
-            feature_array = np.array([[features.get(f, 0) for f in feature_names]])
-        else:
-            feature_array = np.array(features).reshape(1, -1)
-        
-        if model_type == "logistic" and scaler is not None:
-            feature_array = scaler.transform(feature_array)
-        
-        prediction_proba = model.predict_proba(feature_array)[0]
-        prediction_idx = np.argmax(prediction_proba)
-        confidence = float(prediction_proba[prediction_idx])
-        
-        reverse_mapping = {v: k for k, v in risk_mapping.items()}
-        predicted_risk = reverse_mapping.get(prediction_idx, "Unknown")
-        
-        if model_type == "xgboost":
-            explainer = shap.TreeExplainer(model)
-            shap_values_all = explainer.shap_values(feature_array)
-            if isinstance(shap_values_all, list):
-                shap_values = shap_values_all[prediction_idx][0]
-            else:
-                shap_values = shap_values_all[0]
+            rows.append([features.get(f, 0) for f in feature_names])
         else:
-            try:
-                explainer = shap.LinearExplainer(model, feature_array)
-                shap_values_all = explainer.shap_values(feature_array)
-                if isinstance(shap_values_all, list):
-                    shap_values = shap_values_all[prediction_idx][0]
-                else:
-                    shap_values = shap_values_all[0]
-            except Exception:
-                if hasattr(model, 'coef_'):
-                    coef = model.coef_[prediction_idx]
-                    shap_values = (coef * feature_array[0])
-                else:
-                    shap_values = np.ones(len(feature_names)) / len(feature_names)
-        
-        shap_abs = np.abs(shap_values)
-        
-        top_indices = np.argsort(shap_abs)[::-1][:top_n]
-        top_reasons = [feature_names[i] for i in top_indices]
-        
-        feature_importance = {
-            feature_names[i]: float(shap_values[i])
-            for i in range(len(feature_names))
-        }
-        
-        return {
-            'prediction': predicted_risk,
-            'confidence': confidence,
-            'top_reasons': top_reasons,
-            'shap_values': feature_importance
-        }
-        
-    except Exception as e:
-        raise Exception(f"Error generating explanation: {e}")
+            rows.append(np.asarray(features, dtype=float).reshape(-1))
+    return np.array(rows, dtype=float).reshape(len(rows), len(feature_names))
 
 
-def explain_batch(features_list, model_type="xgboost", model_dir="models"):
+def compute_contributions(model, feature_array, prediction_idx, model_type="xgboost"):
+    n_rows, n_features = feature_array.shape
+    rows = np.arange(n_rows)
+    
+    if model_type == "xgboost":
+        # Tree SHAP values computed natively by the booster; last column is the bias term
+        booster = model.get_booster()
+        dmatrix = xgb.DMatrix(feature_array, feature_names=booster.feature_names)
+        contribs = booster.predict(dmatrix, pred_contribs=True)
+        if contribs.ndim == 3:
+            return contribs[rows, prediction_idx, :-1]
+        return contribs[:, :-1]
+    
+    if hasattr(model, 'coef_'):
+        # Exact linear contributions coef * (x - mean). Scaled inputs are already
+        # centred on the training mean, so the background term is zero.
+        coef = model.coef_
+        if coef.shape[0] == 1:
+            return feature_array * coef[0]
+        return feature_array * coef[prediction_idx]
+    
+    return np.ones((n_rows, n_features)) / n_features
+
+
+def explain_matrix(feature_array, model, scaler, risk_mapping, feature_names, model_type="xgboost", top_n=3):
+    if model_type == "logistic" and scaler is not None:
+        feature_array = scaler.transform(feature_array)
+    
+    prediction_proba = model.predict_proba(feature_array)
+    prediction_idx = np.argmax(prediction_proba, axis=1)
+    contributions = compute_contributions(model, feature_array, prediction_idx, model_type)
+    
+    reverse_mapping = {v: k for k, v in risk_mapping.items()}
+    top_indices = np.argsort(-np.abs(contributions), axis=1)[:, :top_n]
+    
     explanations = []
-    for features in features_list:
-        try:
-            explanation = explain_prediction(features, model_type, model_dir)
-            explanations.append(explanation)
-        except Exception as e:
-            print(f"Error explaining prediction: {e}")
-            explanations.append(None)
+    for i in range(len(feature_array)):
+        explanations.append({
+            'prediction': reverse_mapping.get(int(prediction_idx[i]), "Unknown"),
+            'confidence': float(prediction_proba[i, prediction_idx[i]]),
+            'top_reasons': [feature_names[j] for j in top_indices[i]],
+            'probabilities': {
+                reverse_mapping.get(k, str(k)): float(prediction_proba[i, k])
+                for k in range(prediction_proba.shape[1])
+            },
+            'shap_values': {
+                feature_names[j]: float(contributions[i, j])
+                for j in range(len(feature_names))
+            }
+        })
     
     return explanations
 
 
+def explain_prediction(features, model_type="xgboost", model_dir="models", top_n=3, artifacts=None):
+    # Callers holding a loaded (model, scaler, risk_mapping, feature_names) snapshot,
+    # like the API, pass it as `artifacts` so nothing is read from model_dir
+    try:
+        if artifacts is None:
+            with profiling.stage("load_artifacts"):
+                artifacts = load_model_and_artifacts(model_type, model_dir)
+        model, scaler, risk_mapping, feature_names = artifacts
+        with profiling.stage("explain"):
+            feature_array = to_feature_matrix([features], feature_names)
+            explanation = explain_matrix(feature_array, model, scaler, risk_mapping, feature_names, model_type, top_n)[0]
+        profiling.count("rows_explained", 1)
+        return explanation
+    
+    except Exception as e:
+        raise Exception(f"Error generating explanation: {e}")
+
+
+def explain_batch(features_list, model_type="xgboost", model_dir="models", top_n=3, artifacts=None):
+    if len(features_list) == 0:
+        return []
+    
+    try:
+        if artifacts is None:
+            with profiling.stage("load_artifacts"):
+                artifacts = load_model_and_artifacts(model_type, model_dir)
+        model, scaler, risk_mapping, feature_names = artifacts
+        with profiling.stage("explain"):
+            feature_array = to_feature_matrix(features_list, feature_names)
+            explanations = explain_matrix(feature_array, model, scaler, risk_mapping, feature_names, model_type, top_n)
+        profiling.count("rows_explained", len(features_list))
+        return explanations
+    except Exception as e:
+        print(f"Error explaining predictions: {e}")
+        return [None] * len(features_list)
+
+
+def validate_with_shap(features_list, model_type="xgboost", model_dir="models"):
+    # Optional cross-check of the native contributions against the shap package.
+    # Returns the largest absolute difference across all rows and features.
+    import shap
+    
+    model, scaler, risk_mapping, feature_names = load_model_and_artifacts(model_type, model_dir)
+    feature_array = to_feature_matrix(features_list, feature_names)
+    if model_type == "logistic" and scaler is not None:
+        feature_array = scaler.transform(feature_array)
+    
+    prediction_idx = np.argmax(model.predict_proba(feature_array), axis=1)
+    native = compute_contributions(model, feature_array, prediction_idx, model_type)
+    
+    if model_type == "xgboost":
+        explainer = shap.TreeExplainer(model)
+    else:
+        background = np.zeros((1, feature_array.shape[1]))
+        explainer = shap.LinearExplainer(model, background)
+    shap_values_all = explainer.shap_values(pd.DataFrame(feature_array, columns=feature_names))
+    
+    rows = np.arange(len(feature_array))
+    if isinstance(shap_values_all, list):
+        reference = np.stack(shap_values_all, axis=1)[rows, prediction_idx]
+    elif np.ndim(shap_values_all) == 3:
+        reference = np.asarray(shap_values_all)[rows, :, prediction_idx]
+    else:
+        reference = np.asarray(shap_values_all)
+    
+    return float(np.max(np.abs(native - reference)))
+
+
 if __name__ == "__main__":
-    import sys
+    import argparse
+    
+    try:
+        from src.features import fill_missing_rolling_values
+    except ImportError:
+        from features import fill_missing_rolling_values
+    
+    parser = argparse.ArgumentParser(description="Explain a prediction for an example day")
+    parser.add_argument("--validate-shap", action="store_true",
+                        help="Cross-check the native contributions against the shap package")
+    profiling.add_profile_arguments(parser)
+    args = parser.parse_args()
+    
+    if args.profile is not None:
+        profiling.start("explain", args.cprofile_dir)
     
     example_features = {
         'min_temp_c': -5.0,
@@ -118,6 +220,8 @@ if __name__ == "__main__":
         'wind_chill': -8.0,
         'mean_aqi': 3.0
     }
+    # Same imputation as training and the API for a day without rolling history
+    example_features = fill_missing_rolling_values(example_features)
     
     try:
         explanation = explain_prediction(example_features, model_type="xgboost")
@@ -128,7 +232,13 @@ if __name__ == "__main__":
         for i, reason in enumerate(explanation['top_reasons'], 1):
             shap_val = explanation['shap_values'][reason]
             print(f"{i}. {reason}: {shap_val:.4f}")
+        
+        if args.validate_shap:
+            with profiling.stage("validate_shap"):
+                max_diff = validate_with_shap([example_features], model_type="xgboost")
+            print(f"\nMax difference vs shap package: {max_diff:.6f}")
     except Exception as e:
         print(f"Error: {e}")
         print("Make sure models are trained (run train.py first)")
-
+    finally:
+        profiling.finish(args.profile or None)
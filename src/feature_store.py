@@ -0,0 +1,117 @@
+import threading
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+
+# Compact in-memory copy of the latest weather_daily row per city.
+# Rows live in a contiguous float32 matrix addressed through a city -> index map,
+# with parallel arrays for the feature date and the created_at version of each row.
+class FeatureStore:
+    def __init__(self, feature_names, capacity=64):
+        self.feature_names = list(feature_names)
+        self.city_index = {}
+        self.cities = []
+        self.features = np.full((capacity, len(self.feature_names)), np.nan, dtype=np.float32)
+        self.dates = np.full(capacity, np.datetime64('NaT'), dtype='datetime64[D]')
+        self.versions = np.full(capacity, np.datetime64('NaT'), dtype='datetime64[us]')
+        self.last_seen = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.cities)
+
+    def load(self, engine):
+        query = text("""
+            SELECT * FROM (
+                SELECT d.*, ROW_NUMBER() OVER (
+                    PARTITION BY city ORDER BY date DESC, created_at DESC
+                ) AS rn
+                FROM weather_daily d
+            ) latest
+            WHERE rn = 1
+        """)
+        df = pd.read_sql(query, engine)
+        return self._apply(df)
+
+    def refresh(self, engine):
+        if self.last_seen is None:
+            return self.load(engine)
+
+        # created_at has one-second resolution, so re-read the boundary second;
+        # re-applying a row that is already stored is a no-op
+        query = text("""
+            SELECT * FROM weather_daily
+            WHERE created_at >= :since
+        """)
+        df = pd.read_sql(query, engine, params={'since': self.last_seen})
+        return self._apply(df)
+
+    def _apply(self, df):
+        if df.empty:
+            return 0
+
+        df = df.copy()
+        df['date'] = pd.to_datetime(df['date'])
+        df['created_at'] = pd.to_datetime(df['created_at'])
+        df = df.sort_values(['date', 'created_at']).drop_duplicates('city', keep='last')
+
+        values = np.full((len(df), len(self.feature_names)), np.nan, dtype=np.float32)
+        for j, name in enumerate(self.feature_names):
+            if name in df.columns:
+                values[:, j] = pd.to_numeric(df[name], errors='coerce').to_numpy(dtype=np.float32)
+        dates = df['date'].to_numpy(dtype='datetime64[D]')
+        versions = df['created_at'].to_numpy(dtype='datetime64[us]')
+
+        updated = 0
+        with self._lock:
+            for i, city in enumerate(df['city'].to_numpy()):
+                idx = self.city_index.get(city)
+                if idx is None:
+                    idx = self._append_city(city)
+                elif (dates[i], versions[i]) < (self.dates[idx], self.versions[idx]):
+                    continue
+                self.features[idx] = values[i]
+                self.dates[idx] = dates[i]
+                self.versions[idx] = versions[i]
+                updated += 1
+
+            newest = df['created_at'].max().to_pydatetime()
+            if self.last_seen is None or newest > self.last_seen:
+                self.last_seen = newest
+
+        return updated
+
+    def _append_city(self, city):
+        idx = len(self.cities)
+        if idx == len(self.features):
+            capacity = max(1, idx) * 2
+            features = np.full((capacity, len(self.feature_names)), np.nan, dtype=np.float32)
+            features[:idx] = self.features
+            dates = np.full(capacity, np.datetime64('NaT'), dtype='datetime64[D]')
+            dates[:idx] = self.dates
+            versions = np.full(capacity, np.datetime64('NaT'), dtype='datetime64[us]')
+            versions[:idx] = self.versions
+            self.features, self.dates, self.versions = features, dates, versions
+
+        self.city_index[city] = idx
+        self.cities.append(city)
+        return idx
+
+    def get(self, city):
+        with self._lock:
+            idx = self.city_index.get(city)
+            if idx is None:
+                return None
+            row = self.features[idx].copy()
+            row_date = self.dates[idx]
+            row_version = self.versions[idx]
+
+        features = {name: float(row[j]) for j, name in enumerate(self.feature_names)}
+        return features, row_date.astype(object), pd.Timestamp(row_version).to_pydatetime()
+
+    def matrix(self):
+        # Snapshot for batch scoring: (cities, float32 feature matrix, dates)
+        with self._lock:
+            n = len(self.cities)
+            return list(self.cities), self.features[:n].copy(), self.dates[:n].copy()
@@ -1,9 +1,18 @@
 import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, text, bindparam
 from dotenv import dotenv_values
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 import numpy as np
+import argparse
 import sys
+import os
+
+try:
+    from src.drift import record_stats
+    from src import profiling
+except ImportError:
+    from drift import record_stats
+    import profiling
 
 env = dotenv_values(".env")
 
@@ -14,25 +23,67 @@ db_user = env.get("DB_USER")
 db_password = env.get("DB_PASSWORD")
 db_host = env.get("DB_HOST")
 db_name = env.get("DB_NAME")
+stats_dir = env.get("STATS_DIR") or "stats"
+drift_window_days = int(env.get("DRIFT_WINDOW_DAYS") or 7)
 
+BASE_FEATURES = ['min_temp_c', 'avg_temp_c', 'wind_speed', 'humidity', 'wind_chill', 'mean_aqi']
+ROLLING_FEATURES = ['min_temp_3d', 'min_temp_7d', 'aqi_delta_1d', 'avg_temp_delta_1d', 'cold_day_streak']
+FEATURE_COLUMNS = BASE_FEATURES + ROLLING_FEATURES
 
-def compute_wind_chill(temp_c, wind_speed):
-    wind_kmh = wind_speed * 3.6
-    
-    if temp_c > 10 or wind_kmh <= 4.8:
-        return temp_c
+# Days of stored history loaded per city to seed the rolling windows
+WINDOW_DAYS = 7
+COLD_DAY_THRESHOLD_C = 0
+
+
+def compute_wind_chill_array(temp_c, wind_speed):
+    temp_c = np.asarray(temp_c, dtype=float)
+    wind_kmh = np.asarray(wind_speed, dtype=float) * 3.6
     
     wci = 13.12 + 0.6215 * temp_c - 11.37 * (wind_kmh ** 0.16) + 0.3965 * temp_c * (wind_kmh ** 0.16)
-    return wci
+    return np.where((temp_c > 10) | (wind_kmh <= 4.8), temp_c, wci)
 
 
-def compute_risk_level(min_temp_c, mean_aqi, wind_chill):
-    if min_temp_c < -10 or mean_aqi >= 4 or wind_chill < -15:
-        return "High"
-    elif min_temp_c < 0 or mean_aqi >= 3 or wind_chill < -5:
-        return "Moderate"
-    else:
-        return "Low"
+def compute_risk_level_array(min_temp_c, mean_aqi, wind_chill):
+    min_temp_c = np.asarray(min_temp_c, dtype=float)
+    mean_aqi = np.asarray(mean_aqi, dtype=float)
+    wind_chill = np.asarray(wind_chill, dtype=float)
+    
+    high = (min_temp_c < -10) | (mean_aqi >= 4) | (wind_chill < -15)
+    moderate = (min_temp_c < 0) | (mean_aqi >= 3) | (wind_chill < -5)
+    return np.select([high, moderate], ["High", "Moderate"], default="Low")
+
+
+def build_daily_features(weather_df):
+    # Raw readings -> one row per (city, date) with base features and risk label
+    weather_df = weather_df.copy()
+    weather_df['ts'] = pd.to_datetime(weather_df['ts'])
+    weather_df['date'] = weather_df['ts'].dt.date
+    
+    weather_df = weather_df.dropna(subset=['temp_c', 'humidity', 'wind_speed', 'aqi', 'city'])
+    
+    if weather_df.empty:
+        return pd.DataFrame()
+    
+    daily_features = weather_df.groupby(['city', 'date']).agg({
+        'min_temp_c': 'min',
+        'temp_c': 'mean',
+        'wind_speed': 'mean',
+        'humidity': 'mean',
+        'aqi': 'mean'
+    }).reset_index()
+    
+    daily_features.rename(columns={'temp_c': 'avg_temp_c', 'aqi': 'mean_aqi'}, inplace=True)
+    
+    daily_features['wind_chill'] = compute_wind_chill_array(
+        daily_features['avg_temp_c'], daily_features['wind_speed']
+    )
+    
+    daily_features['risk_level'] = compute_risk_level_array(
+        daily_features['min_temp_c'], daily_features['mean_aqi'], daily_features['wind_chill']
+    )
+    
+    daily_features['date'] = pd.to_datetime(daily_features['date']).dt.date
+    return daily_features[['city', 'date'] + BASE_FEATURES + ['risk_level']]
 
 
 def aggregate_daily_features(engine=None):
@@ -42,45 +93,37 @@ def aggregate_daily_features(engine=None):
         engine = create_engine(f"mysql+mysqlconnector://{db_user}:{db_password}@{db_host}/{db_name}")
     
     try:
-        print("Reading raw weather data from database...")
-        weather_df = pd.read_sql(text("SELECT * FROM weather_raw"), engine)
+        # Only re-read each city's raw rows from its own latest aggregated day onwards,
+        # plus every row of cities that have no daily features yet. The cutoff is per
+        # city so one city that stopped ingesting does not widen the read for the rest.
+        with profiling.stage("read_raw"):
+            print("Reading new raw weather data from database...")
+            weather_df = pd.read_sql(text("""
+                SELECT r.* FROM weather_raw r
+                LEFT JOIN (
+                    SELECT city, MAX(date) AS latest_date FROM weather_daily GROUP BY city
+                ) latest ON latest.city = r.city
+                WHERE latest.latest_date IS NULL OR r.ts >= latest.latest_date
+            """), engine)
+        profiling.count("rows_read", len(weather_df))
         
         if weather_df.empty:
             print("No raw weather data found in database.")
             return pd.DataFrame()
         
-        weather_df['ts'] = pd.to_datetime(weather_df['ts'])
-        weather_df['date'] = weather_df['ts'].dt.date
-        weather_df['created_at'] = pd.to_datetime(weather_df['created_at'])
-        
-        weather_df = weather_df.dropna(subset=['temp_c', 'humidity', 'wind_speed', 'aqi', 'city'])
+        print("Computing daily aggregates...")
+        with profiling.stage("aggregate"):
+            daily_features = build_daily_features(weather_df)
+        profiling.count("rows_aggregated", len(daily_features))
         
-        if weather_df.empty:
+        if daily_features.empty:
             print("No valid weather data after cleaning.")
             return pd.DataFrame()
         
-        print("Computing daily aggregates...")
-        daily_features = weather_df.groupby(['city', 'date']).agg({
-            'min_temp_c': 'min',
-            'temp_c': 'mean',
-            'wind_speed': 'mean',
-            'humidity': 'mean',
-            'aqi': 'mean'
-        }).reset_index()
-        
-        daily_features.rename(columns={'temp_c': 'avg_temp_c'}, inplace=True)
-        
-        daily_features['wind_chill'] = daily_features.apply(
-            lambda row: compute_wind_chill(row['avg_temp_c'], row['wind_speed']), axis=1
-        )
-        
-        daily_features.rename(columns={'aqi': 'mean_aqi'}, inplace=True)
-        
-        daily_features['risk_level'] = daily_features.apply(
-            lambda row: compute_risk_level(row['min_temp_c'], row['mean_aqi'], row['wind_chill']), axis=1
-        )
-        
-        daily_features['date'] = pd.to_datetime(daily_features['date']).dt.date
+        with profiling.stage("read_window_state"):
+            window_state = load_window_state(daily_features, engine)
+        with profiling.stage("rolling_features"):
+            daily_features = add_rolling_features(daily_features, window_state)
         
         print(f"Computed daily features for {len(daily_features)} city-date combinations")
         return daily_features
@@ -90,6 +133,136 @@ def aggregate_daily_features(engine=None):
         raise
 
 
+def load_window_state(daily_features, engine):
+    # Stored rows from the WINDOW_DAYS before (and overlapping) the new days, per city
+    if daily_features.empty:
+        return pd.DataFrame()
+    
+    start_date = min(daily_features['date']) - timedelta(days=WINDOW_DAYS)
+    query = text(f"""
+        SELECT city, date, {', '.join(BASE_FEATURES)}, cold_day_streak
+        FROM weather_daily
+        WHERE date >= :start_date AND city IN :cities
+    """).bindparams(bindparam('cities', expanding=True))
+    state = pd.read_sql(query, engine, params={
+        'start_date': start_date,
+        'cities': sorted(daily_features['city'].unique())
+    })
+    if not state.empty:
+        state['date'] = pd.to_datetime(state['date']).dt.date
+        state = state.drop_duplicates(['city', 'date'], keep='last')
+    return state
+
+
+def add_rolling_features(daily_features, window_state=None):
+    # Rolling windows and lags are computed over the stored window state plus the
+    # new days, so each run only touches WINDOW_DAYS of history per city.
+    new = daily_features.copy()
+    new['_new'] = True
+    
+    if window_state is not None and not window_state.empty:
+        state = window_state.copy()
+        state['_new'] = False
+        new_keys = new['city'] + '|' + new['date'].astype(str)
+        state_keys = state['city'] + '|' + state['date'].astype(str)
+        # Days already stored keep their stored values; store_daily_features skips them anyway
+        new = new[~new_keys.isin(state_keys)]
+        combined = pd.concat([state, new], ignore_index=True)
+    else:
+        combined = new
+        combined['cold_day_streak'] = np.nan
+    
+    if combined.empty:
+        return daily_features.iloc[0:0].reindex(columns=list(daily_features.columns) + ROLLING_FEATURES)
+    
+    combined['date'] = pd.to_datetime(combined['date'])
+    combined = combined.sort_values(['city', 'date']).reset_index(drop=True)
+    seed_streak = combined['cold_day_streak'].astype(float)
+    by_city = combined.groupby('city', sort=False)
+    
+    rolling = combined.set_index('date').groupby('city', sort=False)['min_temp_c']
+    combined['min_temp_3d'] = rolling.rolling('3D').min().to_numpy()
+    combined['min_temp_7d'] = rolling.rolling('7D').min().to_numpy()
+    
+    # Lags only count when the previous row is the previous calendar day
+    consecutive = by_city['date'].diff() == pd.Timedelta(days=1)
+    combined['aqi_delta_1d'] = (combined['mean_aqi'] - by_city['mean_aqi'].shift()).where(consecutive, 0.0)
+    combined['avg_temp_delta_1d'] = (combined['avg_temp_c'] - by_city['avg_temp_c'].shift()).where(consecutive, 0.0)
+    
+    # Consecutive cold days: run length of cold days, broken by a warm day or a gap.
+    # The run touching the first row continues from that row's stored streak.
+    cold = combined['min_temp_c'] < COLD_DAY_THRESHOLD_C
+    first_row = ~combined['city'].duplicated()
+    run_break = ~cold | ~(consecutive | first_row)
+    run_id = run_break.groupby(combined['city'], sort=False).cumsum()
+    streak = cold.groupby([combined['city'], run_id], sort=False).cumsum()
+    first_seed = seed_streak.groupby(combined['city'], sort=False).transform('first')
+    carried = (run_id == 0) & cold & (first_seed > 0)
+    streak = streak.where(~carried, streak + first_seed - 1)
+    combined['cold_day_streak'] = streak.astype(int)
+    
+    result = combined[combined['_new']].drop(columns='_new')
+    result['date'] = result['date'].dt.date
+    return result[list(daily_features.columns) + ROLLING_FEATURES].reset_index(drop=True)
+
+
+def fill_missing_rolling_features(df):
+    # Rows aggregated before the rolling features existed behave as if they had no history
+    df = df.copy()
+    for name in ['min_temp_3d', 'min_temp_7d']:
+        df[name] = df[name].fillna(df['min_temp_c']) if name in df else df['min_temp_c']
+    for name in ['aqi_delta_1d', 'avg_temp_delta_1d']:
+        df[name] = df[name].fillna(0.0) if name in df else 0.0
+    cold_today = (df['min_temp_c'] < COLD_DAY_THRESHOLD_C).astype(int)
+    df['cold_day_streak'] = df['cold_day_streak'].fillna(cold_today) if 'cold_day_streak' in df else cold_today
+    return df
+
+
+def fill_missing_rolling_values(features):
+    # fill_missing_rolling_features for one feature dict, used when serving rows
+    # whose rolling columns have not been computed yet
+    features = dict(features)
+    
+    def missing(name):
+        value = features.get(name)
+        return value is None or value != value
+    
+    for name in ['min_temp_3d', 'min_temp_7d']:
+        if missing(name):
+            features[name] = features.get('min_temp_c')
+    for name in ['aqi_delta_1d', 'avg_temp_delta_1d']:
+        if missing(name):
+            features[name] = 0.0
+    if missing('cold_day_streak') and not missing('min_temp_c'):
+        features['cold_day_streak'] = float(features['min_temp_c'] < COLD_DAY_THRESHOLD_C)
+    return features
+
+
+def upsert_daily_features(daily_features, engine, columns):
+    # Insert or overwrite `columns` for each (city, date); relies on the
+    # unique_city_date key on weather_daily. created_at is bumped when a row's
+    # values change, so the API feature store and dashboard ETags see rewrites.
+    if daily_features.empty:
+        return 0
+    
+    unchanged = ' AND '.join(f"{col} <=> VALUES({col})" for col in columns)
+    assignments = ', '.join(f"{col} = VALUES({col})" for col in columns)
+    # created_at is assigned first, while the other columns still hold their old values
+    query = text(f"""
+        INSERT INTO weather_daily (city, date, {', '.join(columns)})
+        VALUES (:city, :date, {', '.join(':' + col for col in columns)})
+        ON DUPLICATE KEY UPDATE
+            created_at = IF({unchanged}, created_at, CURRENT_TIMESTAMP),
+            {assignments}
+    """)
+    
+    records = daily_features[['city', 'date'] + list(columns)].astype(object)
+    records = records.where(pd.notna(records), None).to_dict('records')
+    with engine.begin() as conn:
+        conn.execute(query, records)
+    return len(records)
+
+
 def store_daily_features(daily_features, engine=None):
     if engine is None:
         if not all([db_user, db_password, db_host, db_name]):
@@ -133,6 +306,15 @@ def store_daily_features(daily_features, engine=None):
         
         count = len(daily_features)
         print(f"Stored {count} daily feature records in database.")
+        
+        # Only the rows stored in this run feed the streaming drift statistics
+        try:
+            with profiling.stage("record_stats"):
+                stats_rows = daily_features[[c for c in FEATURE_COLUMNS if c in daily_features]].to_dict('records')
+                record_stats(os.path.join(stats_dir, "daily_stats.json"), stats_rows, FEATURE_COLUMNS, drift_window_days)
+        except Exception as e:
+            print(f"Warning: Could not update feature statistics: {e}")
+        
         return count
         
     except Exception as e:
@@ -155,7 +337,9 @@ def process_features():
             return False
         
         # Store in database
-        count = store_daily_features(daily_features, engine)
+        with profiling.stage("store"):
+            count = store_daily_features(daily_features, engine)
+        profiling.count("rows_stored", count)
         
         if count > 0:
             print(f"Successfully processed {count} daily feature records.")
@@ -170,4 +354,13 @@ def process_features():
 
 
 if __name__ == "__main__":
-    process_features()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Aggregate raw weather readings into daily features")
+    profiling.add_profile_arguments(parser)
+    args = parser.parse_args()
+    
+    if args.profile is not None:
+        profiling.start("features", args.cprofile_dir)
+    try:
+        process_features()
+    finally:
+        profiling.finish(args.profile or None)
\ No newline at end of file
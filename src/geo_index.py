@@ -0,0 +1,28 @@
+import numpy as np
+from sklearn.neighbors import BallTree
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+# Nearest-city lookup over the coordinates of ingested cities. A ball tree with
+# the haversine metric answers k-nearest queries in O(log n), so lookups stay
+# sub-millisecond with tens of thousands of cities.
+class CityIndex:
+    def __init__(self, cities, lats, lons, version=None):
+        self.cities = list(cities)
+        self.version = version
+        coords = np.radians(np.column_stack([lats, lons]).astype(float))
+        self._tree = BallTree(coords, metric='haversine') if len(self.cities) else None
+
+    def __len__(self):
+        return len(self.cities)
+
+    def nearest(self, lat, lon, k=1):
+        if self._tree is None:
+            return []
+        k = min(k, len(self.cities))
+        distances, indices = self._tree.query(np.radians([[lat, lon]]), k=k)
+        return [
+            (self.cities[i], float(d * EARTH_RADIUS_KM))
+            for d, i in zip(distances[0], indices[0])
+        ]
@@ -4,6 +4,14 @@ from mysql.connector import connection
 from datetime import datetime, timezone
 import sys
 import os
+import time
+
+try:
+    from src.spool import IngestSpool, SpoolFlusher
+    from src.drift import RAW_FIELDS, record_stats
+except ImportError:
+    from spool import IngestSpool, SpoolFlusher
+    from drift import RAW_FIELDS, record_stats
 
 env = dotenv_values(".env")
 
@@ -15,6 +23,21 @@ db_user = env.get("DB_USER")
 db_password = env.get("DB_PASSWORD")
 db_host = env.get("DB_HOST")
 db_name = env.get("DB_NAME")
+spool_path = env.get("INGEST_SPOOL_PATH") or "spool/ingest.db"
+spool_batch_size = int(env.get("INGEST_SPOOL_BATCH_SIZE") or 1000)
+# OpenWeather refreshes current conditions roughly every 10 minutes
+observation_refresh_seconds = float(env.get("OBSERVATION_REFRESH_SECONDS") or 600)
+RECENT_KEY_LIMIT = 10000
+stats_dir = env.get("STATS_DIR") or "stats"
+drift_window_days = int(env.get("DRIFT_WINDOW_DAYS") or 7)
+
+# Also persists the last fetch per requested city and recently ingested
+# (city, ts) keys, so they carry over between one-shot runs
+_spool = None
+# Geocoded (lat, lon) per requested city
+_geocodes = {}
+# Readings ingested since the raw statistics were last written
+_pending_stats = []
 
 if not OPENWEATHER_API_KEY or OPENWEATHER_API_KEY == "your_openweather_api_key_here":
     import warnings
@@ -42,7 +65,7 @@ def get_current_weather(city="Toronto", api_key=None):
         
         weather = {
             "city": data["name"],
-            "ts": datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+            "ts": datetime.fromtimestamp(data.get("dt", time.time()), timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
             "temp_c": data["main"]["temp"],
             "min_temp_c": data["main"]["temp_min"],
             "max_temp_c": data["main"]["temp_max"],
@@ -58,7 +81,11 @@ def get_current_weather(city="Toronto", api_key=None):
         raise Exception(f"Failed to fetch weather data: {e}")
 
 
-def get_air_quality(city="Toronto", api_key=None):
+def geocode_city(city="Toronto", api_key=None):
+    # City coordinates don't change, so each city is geocoded once per process
+    if city in _geocodes:
+        return _geocodes[city]
+    
     if api_key is None:
         api_key = OPENWEATHER_API_KEY
     
@@ -72,16 +99,26 @@ def get_air_quality(city="Toronto", api_key=None):
         "appid": api_key
     }
     
+    geo_response = requests.get(geo_url, params=geo_params, timeout=10)
+    geo_response.raise_for_status()
+    geo_data = geo_response.json()
+    
+    if not geo_data:
+        raise ValueError(f"City '{city}' not found")
+    
+    _geocodes[city] = (geo_data[0]["lat"], geo_data[0]["lon"])
+    return _geocodes[city]
+
+
+def get_air_quality(city="Toronto", api_key=None):
+    if api_key is None:
+        api_key = OPENWEATHER_API_KEY
+    
+    if not api_key:
+        raise ValueError("OpenWeatherMap API key is required. Set OPENWEATHER_API_KEY in .env")
+    
     try:
-        geo_response = requests.get(geo_url, params=geo_params, timeout=10)
-        geo_response.raise_for_status()
-        geo_data = geo_response.json()
-        
-        if not geo_data:
-            raise ValueError(f"City '{city}' not found")
-        
-        lat = geo_data[0]["lat"]
-        lon = geo_data[0]["lon"]
+        lat, lon = geocode_city(city, api_key)
         
         aq_url = f"http://api.openweathermap.org/data/2.5/air_pollution"
         aq_params = {
@@ -111,8 +148,20 @@ def get_air_quality(city="Toronto", api_key=None):
         raise Exception(f"Failed to fetch air quality data: {e}")
 
 
-def store_weather_data(weather_data, air_quality_data, db_user=None, db_password=None, 
-                      db_host=None, db_name=None):
+def get_spool():
+    global _spool
+    if _spool is None:
+        _spool = IngestSpool(spool_path)
+    return _spool
+
+
+def spool_weather_data(weather_data, air_quality_data, spool=None):
+    if spool is None:
+        spool = get_spool()
+    spool.append({**weather_data, **air_quality_data})
+
+
+def insert_weather_batch(records, db_user=None, db_password=None, db_host=None, db_name=None):
     if db_user is None:
         db_user = env.get("DB_USER")
     if db_password is None:
@@ -125,48 +174,140 @@ def store_weather_data(weather_data, air_quality_data, db_user=None, db_password
     if not all([db_user, db_password, db_host, db_name]):
         raise ValueError("Database credentials are required. Set DB_USER, DB_PASSWORD, DB_HOST, DB_NAME in .env")
     
-    all_data = {**weather_data, **air_quality_data}
+    config = {
+        'user': db_user,
+        'password': db_password,
+        'host': db_host,
+        'database': db_name
+    }
+    
+    # Group by column set so each group becomes one multi-row INSERT
+    batches = {}
+    for record in records:
+        batches.setdefault(tuple(record.keys()), []).append(tuple(record.values()))
+    
+    db = connection.MySQLConnection(**config)
+    try:
+        cursor = db.cursor()
+        for columns, values in batches.items():
+            placeholders = ', '.join(['%s'] * len(columns))
+            # Readings are keyed on (city, observation ts); replays and re-fetches are no-ops
+            query = f"INSERT IGNORE INTO weather_raw ({', '.join(columns)}) VALUES ({placeholders})"
+            cursor.executemany(query, values)
+        db.commit()
+        cursor.close()
+    finally:
+        db.close()
+
+
+def flush_spool(spool=None, batch_size=None, **db_config):
+    if spool is None:
+        spool = get_spool()
+    if batch_size is None:
+        batch_size = spool_batch_size
+    
+    try:
+        count = spool.flush(lambda records: insert_weather_batch(records, **db_config), batch_size)
+        if count:
+            print(f"Flushed {count} spooled readings to weather_raw")
+        return count
+    except Exception as e:
+        print(f"Error flushing spool ({spool.pending()} readings kept for retry): {e}")
+        return 0
+
+
+def store_weather_data(weather_data, air_quality_data, db_user=None, db_password=None, 
+                      db_host=None, db_name=None):
+    try:
+        spool_weather_data(weather_data, air_quality_data)
+    except Exception as e:
+        print(f"Error storing data: {e}")
+        return False
+    
+    # The reading is durable once spooled; a failed flush is retried on the next one
+    flush_spool(db_user=db_user, db_password=db_password, db_host=db_host, db_name=db_name)
+    return True
+
+
+def store_city_location(city, lat, lon, db_user=None, db_password=None, db_host=None, db_name=None):
+    # Coordinates don't change; the spool remembers which cities are already stored
+    # so a run only opens a connection for cities it has not seen before
+    spool = get_spool()
+    if spool.has_location(city):
+        return True
+    
+    config = {
+        'user': db_user or env.get("DB_USER"),
+        'password': db_password or env.get("DB_PASSWORD"),
+        'host': db_host or env.get("DB_HOST"),
+        'database': db_name or env.get("DB_NAME")
+    }
     
     try:
-        config = {
-            'user': db_user,
-            'password': db_password,
-            'host': db_host,
-            'database': db_name
-        }
-        
         db = connection.MySQLConnection(**config)
         cursor = db.cursor()
-        
-        columns = ', '.join(all_data.keys())
-        placeholders = ', '.join(['%s'] * len(all_data))
-        values = tuple(all_data.values())
-        
-        query = f"INSERT INTO weather_raw ({columns}) VALUES ({placeholders})"
-        cursor.execute(query, values)
-        
+        cursor.execute("""
+            INSERT INTO city_locations (city, lat, lon)
+            VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE lat = VALUES(lat), lon = VALUES(lon)
+        """, (city, lat, lon))
         db.commit()
         cursor.close()
         db.close()
-        
+        spool.remember_location(city)
         return True
     except Exception as e:
-        print(f"Error storing data: {e}")
+        print(f"Warning: Could not store location for {city}: {e}")
         return False
 
 
-def ingest_data(city="Toronto"):
+def save_raw_stats():
+    global _pending_stats
+    if not _pending_stats:
+        return
     try:
+        record_stats(os.path.join(stats_dir, "raw_stats.json"), _pending_stats, RAW_FIELDS, drift_window_days)
+        _pending_stats = []
+    except Exception as e:
+        print(f"Warning: Could not update raw data statistics: {e}")
+
+
+def ingest_data(city="Toronto", flush=True):
+    try:
+        spool = get_spool()
+        last_fetch = spool.last_fetch(city)
+        if last_fetch is not None and time.time() - last_fetch < observation_refresh_seconds:
+            print(f"Skipping {city}: already fetched within the last {observation_refresh_seconds:.0f}s")
+            return True
+        
         print(f"Fetching weather data for {city}...")
         weather_data = get_current_weather(city)
         
+        if spool.has_observation(weather_data["city"], weather_data["ts"]):
+            print(f"Skipping {city}: observation at {weather_data['ts']} already ingested")
+            spool.record_fetch(city)
+            return True
+        
         print(f"Fetching air quality data for {city}...")
         air_quality_data = get_air_quality(city)
         
-        print(f"Storing data in database...")
-        success = store_weather_data(weather_data, air_quality_data)
+        if flush:
+            print(f"Storing data in database...")
+            success = store_weather_data(weather_data, air_quality_data)
+        else:
+            spool_weather_data(weather_data, air_quality_data)
+            success = True
         
         if success:
+            # Coordinates are keyed by the API's city name, which is what weather_daily uses
+            lat, lon = geocode_city(city)
+            store_city_location(weather_data["city"], lat, lon)
+            
+            spool.record_fetch(city)
+            spool.remember_observation(weather_data["city"], weather_data["ts"], RECENT_KEY_LIMIT)
+            _pending_stats.append({**weather_data, **air_quality_data})
+            if flush:
+                save_raw_stats()
             print(f"Data successfully ingested for {city}")
             return True
         else:
@@ -177,6 +318,23 @@ def ingest_data(city="Toronto"):
         return False
 
 
+def ingest_cities(cities, flush_interval=5.0):
+    # Readings are spooled locally while a background flusher bulk-loads them,
+    # so slow or unavailable MySQL never holds up the API fetches
+    flusher = SpoolFlusher(flush_spool, flush_interval)
+    flusher.start()
+    try:
+        results = {city: ingest_data(city, flush=False) for city in cities}
+    finally:
+        flusher.stop()
+        save_raw_stats()
+    
+    pending = get_spool().pending()
+    if pending:
+        print(f"{pending} readings remain spooled and will be flushed on the next run")
+    return results
+
+
 if __name__ == "__main__":
-    city = sys.argv[1] if len(sys.argv) > 1 else "Toronto"
-    ingest_data(city)
\ No newline at end of file
+    cities = sys.argv[1:] or ["Toronto"]
+    ingest_cities(cities)
\ No newline at end of file
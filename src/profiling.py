@@ -0,0 +1,149 @@
+import cProfile
+import json
+import os
+import resource
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+# Active profiler for this process; stage() and count() are no-ops while it is None
+_active = None
+
+
+class PipelineProfiler:
+    def __init__(self, run_name, cprofile_dir=None, track_memory=True, thread_cpu=False):
+        self.run_name = run_name
+        self.cprofile_dir = cprofile_dir
+        self.track_memory = track_memory
+        # Process CPU time includes XGBoost/OpenMP and BLAS threads. Per-thread CPU
+        # time is only meaningful when stages run concurrently, as in the API.
+        self._cpu_clock = time.thread_time if thread_cpu else time.process_time
+        self.started_at = datetime.now().isoformat(timespec='seconds')
+        self.stages = {}
+        self.rows = {}
+        self._profiles = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        if track_memory:
+            tracemalloc.start()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def stage(self, name):
+        stack = self._stack()
+        # cProfile can only run one profiler at a time, so only outermost stages are
+        # profiled; repeated calls accumulate into the same profile
+        profile = None
+        if self.cprofile_dir and not stack:
+            profile = self._profiles.setdefault(name, cProfile.Profile())
+        frame = {'peak': 0}
+        stack.append(frame)
+        if self.track_memory:
+            tracemalloc.reset_peak()
+        wall_start = time.perf_counter()
+        cpu_start = self._cpu_clock()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            wall = time.perf_counter() - wall_start
+            cpu = self._cpu_clock() - cpu_start
+            stack.pop()
+            peak = 0
+            if self.track_memory:
+                # Fold in peaks of nested stages, which reset the tracemalloc peak
+                peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+                if stack:
+                    stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+                tracemalloc.reset_peak()
+
+            with self._lock:
+                entry = self.stages.setdefault(name, {'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'peak_mb': 0.0})
+                entry['calls'] += 1
+                entry['wall_s'] += wall
+                entry['cpu_s'] += cpu
+                entry['peak_mb'] = max(entry['peak_mb'], peak / 2 ** 20)
+
+    def count(self, name, n):
+        with self._lock:
+            self.rows[name] = self.rows.get(name, 0) + int(n)
+
+    def report(self):
+        with self._lock:
+            return {
+                'run': self.run_name,
+                'started_at': self.started_at,
+                'wall_s': time.perf_counter() - self._wall_start,
+                'cpu_s': time.process_time() - self._cpu_start,
+                # ru_maxrss is reported in kilobytes on Linux
+                'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                'stages': {name: dict(entry) for name, entry in self.stages.items()},
+                'rows': dict(self.rows)
+            }
+
+    def write(self, path=None):
+        if path is None:
+            timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+            path = os.path.join("profiles", f"{self.run_name}_{timestamp}.json")
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+        if self._profiles:
+            os.makedirs(self.cprofile_dir, exist_ok=True)
+            for name, profile in self._profiles.items():
+                profile.dump_stats(os.path.join(self.cprofile_dir, f"{self.run_name}_{name}.prof"))
+        return path
+
+
+def start(run_name, cprofile_dir=None, track_memory=True, thread_cpu=False):
+    global _active
+    _active = PipelineProfiler(run_name, cprofile_dir, track_memory, thread_cpu)
+    return _active
+
+
+def finish(path=None):
+    global _active
+    if _active is None:
+        return None
+    profiler, _active = _active, None
+    path = profiler.write(path)
+    if profiler.track_memory:
+        tracemalloc.stop()
+    print(f"Wrote profile report to {path}")
+    return path
+
+
+@contextmanager
+def stage(name):
+    if _active is None:
+        yield
+    else:
+        with _active.stage(name):
+            yield
+
+
+def count(name, n):
+    if _active is not None:
+        _active.count(name, n)
+
+
+def add_profile_arguments(parser):
+    parser.add_argument("--profile", nargs="?", const="", default=None, metavar="REPORT_PATH",
+                        help="Record per-stage time, memory and row counts to a JSON report "
+                             "(default: profiles/<run>_<timestamp>.json)")
+    parser.add_argument("--cprofile-dir", default=None,
+                        help="With --profile, also dump cProfile stats for each top-level stage here")
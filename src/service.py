@@ -1,19 +1,36 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional, List
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, PrivateAttr
+from typing import Optional, List, Dict
 from datetime import datetime, date, timedelta
+import asyncio
 import pandas as pd
 from sqlalchemy import create_engine, text
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.pool import QueuePool
 from dotenv import dotenv_values
-import joblib
 import os
+import gc
+import hashlib
+import time
 import numpy as np
 
 try:
-    from src.explain import explain_prediction
+    from src.explain import MODEL_FILES, explain_prediction, load_model_and_artifacts
+    from src.feature_store import FeatureStore
+    from src.geo_index import CityIndex
+    from src.drift import load_window_stats, load_snapshot, compare_stats
+    from src.features import fill_missing_rolling_values
+    from src import profiling
 except ImportError:
-    from explain import explain_prediction
+    from explain import MODEL_FILES, explain_prediction, load_model_and_artifacts
+    from feature_store import FeatureStore
+    from geo_index import CityIndex
+    from drift import load_window_stats, load_snapshot, compare_stats
+    from features import fill_missing_rolling_values
+    import profiling
 
 env = dotenv_values(".env")
 
@@ -25,6 +42,17 @@ db_user = env.get("DB_USER")
 db_password = env.get("DB_PASSWORD")
 db_host = env.get("DB_HOST")
 db_name = env.get("DB_NAME")
+db_read_host = env.get("DB_READ_HOST")
+db_pool_size = int(env.get("DB_POOL_SIZE") or 5)
+db_max_overflow = int(env.get("DB_MAX_OVERFLOW") or 10)
+db_pool_timeout = float(env.get("DB_POOL_TIMEOUT") or 30)
+db_pool_recycle = int(env.get("DB_POOL_RECYCLE") or 1800)
+db_pool_pre_ping = (env.get("DB_POOL_PRE_PING") or "true").lower() == "true"
+replica_retry_seconds = float(env.get("DB_READ_RETRY_SECONDS") or 30)
+feature_store_refresh_seconds = float(env.get("FEATURE_STORE_REFRESH_SECONDS") or 30)
+model_reload_check_seconds = float(env.get("MODEL_RELOAD_CHECK_SECONDS") or 60)
+stats_dir = env.get("STATS_DIR") or "stats"
+profile_service = (env.get("PROFILE_SERVICE") or "false").lower() == "true"
 
 app = FastAPI(title="ClimaGuard API", description="Cold & Air Quality Early Warning System")
 
@@ -34,67 +62,260 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
+app.add_middleware(GZipMiddleware, minimum_size=1000)
 
 engine = None
+read_engine = None
+models_preloaded = False
+# Reads go to the primary until this time after the replica fails a connection
+_replica_down_until = 0.0
 models = {}
+feature_store = None
+city_index = None
+
+# In-flight computations keyed by request identity, shared by concurrent callers
+_inflight = {}
+
+
+def create_db_engine(host):
+    if not all([db_user, db_password, host, db_name]):
+        raise ValueError("Database credentials are required. Set DB_USER, DB_PASSWORD, DB_HOST, DB_NAME in .env")
+    # Engines are created lazily in each worker, never in a forking master
+    return create_engine(
+        f"mysql+mysqlconnector://{db_user}:{db_password}@{host}/{db_name}",
+        pool_size=db_pool_size,
+        max_overflow=db_max_overflow,
+        pool_timeout=db_pool_timeout,
+        pool_recycle=db_pool_recycle,
+        pool_pre_ping=db_pool_pre_ping
+    )
 
 
 def get_db_engine():
     global engine
     if engine is None:
-        if not all([db_user, db_password, db_host, db_name]):
-            raise ValueError("Database credentials are required. Set DB_USER, DB_PASSWORD, DB_HOST, DB_NAME in .env")
-        engine = create_engine(f"mysql+mysqlconnector://{db_user}:{db_password}@{db_host}/{db_name}")
+        engine = create_db_engine(db_host)
     return engine
 
 
-def load_models():
-    global models
-    model_dir = "models"
-    
+def get_read_engine():
+    # Replica engine for read-only queries, or None when no replica is configured
+    global read_engine
+    if not db_read_host:
+        return None
+    if read_engine is None:
+        read_engine = create_db_engine(db_read_host)
+    return read_engine
+
+
+def run_read(func, *args):
+    # Run func(engine, *args) against the replica, falling back to the primary when
+    # the replica cannot be reached. Only read-only work may go through here.
+    global _replica_down_until
+    replica = get_read_engine()
+    if replica is not None and time.monotonic() >= _replica_down_until:
+        try:
+            return func(replica, *args)
+        except (OperationalError, InterfaceError) as e:
+            _replica_down_until = time.monotonic() + replica_retry_seconds
+            print(f"Warning: Read replica unavailable, using primary for {replica_retry_seconds:.0f}s: {e}")
+    return func(get_db_engine(), *args)
+
+
+def read_sql(query, params=None):
+    return run_read(lambda db_engine: pd.read_sql(query, db_engine, params=params))
+
+
+def pool_status(db_engine):
+    if db_engine is None:
+        return None
+    pool = db_engine.pool
+    if not isinstance(pool, QueuePool):
+        return {'status': pool.status()}
+    return {
+        'size': pool.size(),
+        'checked_out': pool.checkedout(),
+        'overflow': pool.overflow(),
+        'checked_in': pool.checkedin()
+    }
+
+
+def read_model_version(model_dir="models"):
+    version_path = os.path.join(model_dir, "VERSION")
+    if not os.path.exists(version_path):
+        return None
+    with open(version_path) as f:
+        return f.read().strip()
+
+
+def build_models(model_dir="models"):
     if not os.path.exists(model_dir):
         raise FileNotFoundError(f"Models directory not found: {model_dir}. Run train.py first.")
     
+    # Requests explain from the 'artifacts' snapshot taken here and never read
+    # model_dir themselves, so a retrain cannot change models under a request.
+    loaded = {'version': read_model_version(model_dir), 'artifacts': {}}
+    for model_type, filename in MODEL_FILES.items():
+        if os.path.exists(os.path.join(model_dir, filename)):
+            loaded['artifacts'][model_type] = load_model_and_artifacts(model_type, model_dir)
+    
     # Try to load XGBoost (preferred)
     xgboost_path = os.path.join(model_dir, "xgboost.joblib")
     if os.path.exists(xgboost_path):
-        models['xgboost'] = joblib.load(xgboost_path)
-        models['model_type'] = 'xgboost'
+        model, _, risk_mapping, feature_names = load_model_and_artifacts('xgboost', model_dir)
+        loaded['xgboost'] = model
+        loaded['model_type'] = 'xgboost'
         print("Loaded XGBoost model")
     else:
         # Fall back to Logistic Regression
         logistic_path = os.path.join(model_dir, "logistic_regression.joblib")
         if os.path.exists(logistic_path):
-            models['logistic'] = joblib.load(logistic_path)
-            scaler_path = os.path.join(model_dir, "scaler.joblib")
-            if os.path.exists(scaler_path):
-                models['scaler'] = joblib.load(scaler_path)
-            models['model_type'] = 'logistic'
+            model, scaler, risk_mapping, feature_names = load_model_and_artifacts('logistic', model_dir)
+            loaded['logistic'] = model
+            if scaler is not None:
+                loaded['scaler'] = scaler
+            loaded['model_type'] = 'logistic'
             print("Loaded Logistic Regression model")
         else:
             raise FileNotFoundError("No trained models found. Run train.py first.")
     
-    # Load risk mapping and feature names
-    risk_mapping_path = os.path.join(model_dir, "risk_mapping.joblib")
-    if os.path.exists(risk_mapping_path):
-        models['risk_mapping'] = joblib.load(risk_mapping_path)
-    
-    feature_names_path = os.path.join(model_dir, "feature_names.joblib")
-    if os.path.exists(feature_names_path):
-        models['feature_names'] = joblib.load(feature_names_path)
-    else:
-        models['feature_names'] = ['min_temp_c', 'avg_temp_c', 'wind_speed', 'humidity', 'wind_chill', 'mean_aqi']
+    loaded['risk_mapping'] = risk_mapping
+    loaded['feature_names'] = feature_names
+    return loaded
+
+
+def load_models():
+    # Built aside and swapped in with a single assignment, so requests never see
+    # a half-loaded mix of versions
+    global models
+    models = build_models()
+
+
+def preload_models():
+    # Called in the pre-fork master (see gunicorn.conf.py), at startup and again
+    # for each new model version before the workers are replaced. Freezing the heap
+    # afterwards keeps the garbage collector from writing to the model objects'
+    # pages, so forked workers keep sharing them copy-on-write.
+    global models_preloaded
+    gc.unfreeze()
+    load_models()
+    gc.collect()
+    gc.freeze()
+    models_preloaded = True
 
 
 @app.on_event("startup")
 async def startup_event():
+    if profile_service:
+        # Requests overlap in the threadpool, so stage CPU is per thread and per-stage
+        # peak memory is not tracked here
+        profiling.start(f"service_{os.getpid()}", track_memory=False, thread_cpu=True)
+        print("Profiling enabled; the report is written on shutdown")
+    
     try:
-        load_models()
+        # Models preloaded in a forking master are inherited as-is
+        if not models_preloaded:
+            load_models()
         print("Models loaded successfully")
     except Exception as e:
         print(f"Warning: Could not load models: {e}")
         print("API will still start, but /risk endpoint may not work until models are trained.")
+    
+    # Under gunicorn the master reloads new versions and replaces the workers
+    if not models_preloaded:
+        asyncio.create_task(reload_models_on_new_version())
+    
+    try:
+        load_feature_store()
+        print(f"Feature store loaded with {len(feature_store)} cities")
+        asyncio.create_task(refresh_feature_store_periodically())
+    except Exception as e:
+        print(f"Warning: Could not load feature store: {e}")
+        print("/risk will read features from the database on every request.")
+    
+    try:
+        refresh_city_index()
+        print(f"City index loaded with {len(city_index)} cities")
+    except Exception as e:
+        print(f"Warning: Could not load city index: {e}")
+        print("/risk will only accept city names until city_locations is available.")
+    asyncio.create_task(refresh_city_index_periodically())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    profiling.finish()
+
+
+def build_feature_store(feature_names):
+    store = FeatureStore(feature_names)
+    run_read(store.load)
+    return store
+
+
+def load_feature_store():
+    global feature_store
+    feature_store = build_feature_store(
+        models.get('feature_names', ['min_temp_c', 'avg_temp_c', 'wind_speed', 'humidity', 'wind_chill', 'mean_aqi'])
+    )
+
+
+def refresh_city_index():
+    # Rebuilt only when city_locations changes; the tree itself is immutable
+    global city_index
+    version = tuple(read_sql(text("""
+        SELECT COUNT(*) AS n, MAX(updated_at) AS updated_at FROM city_locations
+    """)).iloc[0])
+    if city_index is not None and city_index.version == version:
+        return
+    
+    locations = read_sql(text("SELECT city, lat, lon FROM city_locations"))
+    city_index = CityIndex(locations['city'], locations['lat'], locations['lon'], version=version)
+
+
+async def refresh_feature_store_periodically():
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(feature_store_refresh_seconds)
+        try:
+            await loop.run_in_executor(None, run_read, feature_store.refresh)
+        except Exception as e:
+            print(f"Warning: Feature store refresh failed: {e}")
+
+
+async def refresh_city_index_periodically():
+    # Independent of the feature store, so a failed index load at startup is retried
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(feature_store_refresh_seconds)
+        try:
+            await loop.run_in_executor(None, refresh_city_index)
+        except Exception as e:
+            print(f"Warning: City index refresh failed: {e}")
+
+
+async def reload_models_on_new_version():
+    # Single-process mode only. train.py writes models/VERSION last, after every
+    # artifact is in place. A store for a changed feature schema is built before
+    # the swap, so the new model never scores rows of the old schema.
+    global models, feature_store
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(model_reload_check_seconds)
+        try:
+            version = read_model_version()
+            if version is None or version == models.get('version'):
+                continue
+            loaded = await loop.run_in_executor(None, build_models)
+            store = feature_store
+            if store is None or store.feature_names != list(loaded['feature_names']):
+                store = await loop.run_in_executor(None, build_feature_store, loaded['feature_names'])
+            models, feature_store = loaded, store
+            print(f"Reloaded models (version {version})")
+        except Exception as e:
+            print(f"Warning: Model reload failed: {e}")
 
 
 class RiskResponse(BaseModel):
@@ -103,6 +324,10 @@ class RiskResponse(BaseModel):
     risk: str
     confidence: float
     top_reasons: List[str]
+    probabilities: Optional[Dict[str, float]] = None
+    distance_km: Optional[float] = None
+    # created_at of the weather_daily row that was scored; not part of the response
+    _feature_version: Optional[datetime] = PrivateAttr(default=None)
 
 
 class HistoryEntry(BaseModel):
@@ -121,6 +346,13 @@ class HistoryEntry(BaseModel):
 class HistoryResponse(BaseModel):
     city: str
     entries: List[HistoryEntry]
+    # Latest created_at of the weather_daily rows read; not part of the response
+    _daily_version: Optional[datetime] = PrivateAttr(default=None)
+
+
+class DashboardResponse(BaseModel):
+    risk: RiskResponse
+    history: HistoryResponse
 
 
 @app.get("/")
@@ -130,6 +362,8 @@ async def root():
         "endpoints": {
             "/risk": "Get risk prediction for a city",
             "/history": "Get historical weather and predictions for a city",
+            "/dashboard": "Get risk prediction and history for a city in one response",
+            "/drift": "Compare recent feature statistics against the training snapshot",
             "/health": "Health check endpoint"
         }
     }
@@ -137,56 +371,85 @@ async def root():
 
 @app.get("/health")
 async def health():
-    return {"status": "healthy", "models_loaded": "model_type" in models}
+    return {
+        "status": "healthy",
+        "models_loaded": "model_type" in models,
+        "model_version": models.get('version'),
+        "db_pool": pool_status(engine),
+        "read_pool": pool_status(read_engine),
+        "read_replica_available": read_engine is not None and time.monotonic() >= _replica_down_until
+    }
 
 
-@app.get("/risk", response_model=RiskResponse)
-async def get_risk(
-    city: str = Query(..., description="City name"),
-    model_type: Optional[str] = Query("xgboost", description="Model type: xgboost or logistic")
-):
+# Run func(*args) in the threadpool, sharing one in-flight call per key so a burst
+# of identical requests costs a single computation. The shared future is shielded
+# so one disconnecting client does not cancel it for the others.
+async def run_coalesced(key, func, *args):
+    future = _inflight.get(key)
+    if future is None:
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(None, func, *args)
+        _inflight[key] = future
+
+        def _release(done, key=key):
+            if _inflight.get(key) is done:
+                del _inflight[key]
+
+        future.add_done_callback(_release)
+    return await asyncio.shield(future)
+
+
+def compute_risk(city, model_type):
     try:
-        if 'model_type' not in models:
-            raise HTTPException(status_code=503, detail="Models not loaded. Run train.py first.")
-        
-        if model_type not in models and model_type != models.get('model_type'):
-            model_type = models.get('model_type', 'xgboost')
-        
         engine = get_db_engine()
+        feature_names = models.get('feature_names', ['min_temp_c', 'avg_temp_c', 'wind_speed', 'humidity', 'wind_chill', 'mean_aqi'])
         
-        query = text("""
-            SELECT * FROM weather_daily 
-            WHERE city = :city 
-            ORDER BY date DESC, created_at DESC 
-            LIMIT 1
-        """)
-        df = pd.read_sql(query, engine, params={'city': city})
-        
-        if df.empty:
-            raise HTTPException(
-                status_code=404,
-                detail=f"No weather data found for city: {city}. Run ingest.py and features.py first."
-            )
+        cached = feature_store.get(city) if feature_store is not None else None
+        if cached is not None:
+            features, _, feature_version = cached
+        else:
+            # Cities not yet picked up by the store refresh fall back to the database
+            query = text("""
+                SELECT * FROM weather_daily 
+                WHERE city = :city 
+                ORDER BY date DESC, created_at DESC 
+                LIMIT 1
+            """)
+            with profiling.stage("read_features"):
+                df = read_sql(query, params={'city': city})
+            
+            if df.empty:
+                raise HTTPException(
+                    status_code=404,
+                    detail=f"No weather data found for city: {city}. Run ingest.py and features.py first."
+                )
+            
+            row = df.iloc[0]
+            feature_version = row['created_at']
+            features = {name: None if pd.isna(row[name]) else float(row[name]) for name in feature_names if name in row}
         
-        row = df.iloc[0]
-        feature_names = models.get('feature_names', ['min_temp_c', 'avg_temp_c', 'wind_speed', 'humidity', 'wind_chill', 'mean_aqi'])
-        features = {name: float(row[name]) for name in feature_names if name in row}
+        # Rows stored before the rolling features existed are imputed as in training
+        features = fill_missing_rolling_values(features)
         
         prediction_date = date.today()
         
         try:
+            artifacts = models.get('artifacts', {}).get(model_type)
+            if artifacts is None:
+                raise ValueError(f"No {model_type} model loaded")
             explanation = explain_prediction(
                 features,
                 model_type=model_type,
-                model_dir="models",
-                top_n=3
+                top_n=3,
+                artifacts=artifacts
             )
             
             predicted_risk = explanation['prediction']
             confidence = explanation['confidence']
             top_reasons = explanation['top_reasons']
+            probabilities = explanation['probabilities']
         except Exception as e:
-            print(f"Warning: SHAP explanation failed: {e}. Using direct prediction.")
+            print(f"Warning: Explanation failed: {e}. Using direct prediction.")
             
             model = models.get(model_type) or models.get('xgboost') or models.get('logistic')
             if not model:
@@ -205,16 +468,21 @@ async def get_risk(
             reverse_mapping = {v: k for k, v in risk_mapping.items()}
             predicted_risk = reverse_mapping.get(prediction_idx, "Unknown")
             top_reasons = feature_names[:3]
+            probabilities = {reverse_mapping.get(k, str(k)): float(p) for k, p in enumerate(prediction_proba)}
         
         try:
-            with engine.connect() as conn:
+            with profiling.stage("store_prediction"), engine.connect() as conn:
                 insert_query = text("""
                     INSERT INTO predictions (city, date, predicted_risk, confidence)
                     VALUES (:city, :date, :predicted_risk, :confidence)
                     ON DUPLICATE KEY UPDATE
+                        created_at = IF(
+                            predicted_risk <=> VALUES(predicted_risk) AND confidence <=> VALUES(confidence),
+                            created_at,
+                            CURRENT_TIMESTAMP
+                        ),
                         predicted_risk = VALUES(predicted_risk),
-                        confidence = VALUES(confidence),
-                        created_at = CURRENT_TIMESTAMP
+                        confidence = VALUES(confidence)
                 """)
                 conn.execute(insert_query, {
                     'city': city,
@@ -226,13 +494,16 @@ async def get_risk(
         except Exception as e:
             print(f"Warning: Could not store prediction in database: {e}")
         
-        return RiskResponse(
+        response = RiskResponse(
             city=city,
             date=prediction_date.isoformat(),
             risk=predicted_risk,
             confidence=confidence,
-            top_reasons=top_reasons
+            top_reasons=top_reasons,
+            probabilities=probabilities
         )
+        response._feature_version = feature_version
+        return response
         
     except HTTPException:
         raise
@@ -240,14 +511,67 @@ async def get_risk(
         raise HTTPException(status_code=500, detail=f"Error getting risk prediction: {str(e)}")
 
 
-@app.get("/history", response_model=HistoryResponse)
-async def get_history(
-    city: str = Query(..., description="City name"),
-    days: int = Query(30, ge=1, le=365, description="Number of days to retrieve (1-365)")
+def blend_risks(risks, distances):
+    # Inverse-distance weighted class probabilities; a city within 1 km counts as exact
+    weights = [1.0 / max(distance, 1.0) for distance in distances]
+    blended = {}
+    for risk, weight in zip(risks, weights):
+        for label, probability in (risk.probabilities or {risk.risk: risk.confidence}).items():
+            blended[label] = blended.get(label, 0.0) + weight * probability
+    total = sum(weights)
+    blended = {label: value / total for label, value in blended.items()}
+    
+    predicted_risk = max(blended, key=blended.get)
+    return risks[0].model_copy(update={
+        'risk': predicted_risk,
+        'confidence': blended[predicted_risk],
+        'probabilities': blended,
+        'distance_km': distances[0]
+    })
+
+
+@app.get("/risk", response_model=RiskResponse)
+async def get_risk(
+    city: Optional[str] = Query(None, description="City name"),
+    lat: Optional[float] = Query(None, ge=-90, le=90, description="Latitude, used when city is not given"),
+    lon: Optional[float] = Query(None, ge=-180, le=180, description="Longitude, used when city is not given"),
+    neighbors: int = Query(1, ge=1, le=10, description="Nearby cities to blend by inverse distance (lat/lon only)"),
+    model_type: Optional[str] = Query("xgboost", description="Model type: xgboost or logistic")
 ):
+    if 'model_type' not in models:
+        raise HTTPException(status_code=503, detail="Models not loaded. Run train.py first.")
+    
+    if model_type not in models and model_type != models.get('model_type'):
+        model_type = models.get('model_type', 'xgboost')
+    
+    if city is not None:
+        return await run_coalesced(('risk', city, model_type), compute_risk, city, model_type)
+    
+    if lat is None or lon is None:
+        raise HTTPException(status_code=400, detail="Provide either city or both lat and lon.")
+    if city_index is None or len(city_index) == 0:
+        raise HTTPException(status_code=503, detail="City locations not loaded. Run ingest.py first.")
+    
+    nearest = city_index.nearest(lat, lon, neighbors)
+    results = await asyncio.gather(*[
+        run_coalesced(('risk', name, model_type), compute_risk, name, model_type)
+        for name, _ in nearest
+    ], return_exceptions=True)
+    
+    # Neighbours without usable data are skipped rather than failing the whole lookup
+    scored = [(risk, distance) for risk, (_, distance) in zip(results, nearest) if not isinstance(risk, Exception)]
+    if not scored:
+        raise results[0]
+    risks = [risk for risk, _ in scored]
+    distances = [distance for _, distance in scored]
+    
+    if len(risks) == 1:
+        return risks[0].model_copy(update={'distance_km': distances[0]})
+    return blend_risks(risks, distances)
+
+
+def compute_history(city, days):
     try:
-        engine = get_db_engine()
-        
         end_date = date.today()
         start_date = end_date - timedelta(days=days)
         
@@ -256,22 +580,23 @@ async def get_history(
             WHERE city = :city AND date >= :start_date AND date <= :end_date
             ORDER BY date DESC
         """)
-        weather_df = pd.read_sql(weather_query, engine, params={
-            'city': city,
-            'start_date': start_date,
-            'end_date': end_date
-        })
-        
         pred_query = text("""
             SELECT * FROM predictions 
             WHERE city = :city AND date >= :start_date AND date <= :end_date
             ORDER BY date DESC
         """)
-        pred_df = pd.read_sql(pred_query, engine, params={
-            'city': city,
-            'start_date': start_date,
-            'end_date': end_date
-        })
+        with profiling.stage("read_history"):
+            weather_df = read_sql(weather_query, params={
+                'city': city,
+                'start_date': start_date,
+                'end_date': end_date
+            })
+            pred_df = read_sql(pred_query, params={
+                'city': city,
+                'start_date': start_date,
+                'end_date': end_date
+            })
+        profiling.count("rows_read", len(weather_df) + len(pred_df))
         
         entries = []
         for _, row in weather_df.iterrows():
@@ -302,12 +627,137 @@ async def get_history(
             )
             entries.append(entry)
         
-        return HistoryResponse(city=city, entries=entries)
+        history = HistoryResponse(city=city, entries=entries)
+        if not weather_df.empty:
+            history._daily_version = weather_df['created_at'].max()
+        return history
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error getting history: {str(e)}")
 
 
+@app.get("/history", response_model=HistoryResponse)
+async def get_history(
+    city: str = Query(..., description="City name"),
+    days: int = Query(30, ge=1, le=365, description="Number of days to retrieve (1-365)")
+):
+    return compute_history(city, days)
+
+
+def read_city_version(city, days):
+    # What /dashboard would return, without scoring: the history window's rows, the
+    # row /risk scores (the latest day, as in FeatureStore) and today's prediction.
+    # Every subquery is a range or lookup on a (city, date) unique key.
+    end_date = date.today()
+    query = text("""
+        SELECT
+            (SELECT MAX(created_at) FROM weather_daily
+             WHERE city = :city AND date >= :start_date AND date <= :end_date) AS daily_version,
+            (SELECT created_at FROM weather_daily WHERE city = :city
+             ORDER BY date DESC, created_at DESC LIMIT 1) AS feature_version,
+            (SELECT predicted_risk FROM predictions WHERE city = :city AND date = :end_date) AS predicted_risk,
+            (SELECT confidence FROM predictions WHERE city = :city AND date = :end_date) AS confidence
+    """)
+    def _read(db_engine):
+        with db_engine.connect() as conn:
+            return conn.execute(query, {
+                'city': city,
+                'start_date': end_date - timedelta(days=days),
+                'end_date': end_date
+            }).one()
+    
+    row = run_read(_read)
+    return row.daily_version, row.feature_version, row.predicted_risk, row.confidence
+
+
+def make_etag(city, days, model_type, version):
+    daily_version, feature_version, predicted_risk, confidence = version
+    # Versions are normalised so DB datetimes and feature store timestamps compare
+    # equal, and confidence is rounded because predictions stores it as a FLOAT
+    daily_version, feature_version = (
+        None if v is None or pd.isna(v) else pd.Timestamp(v).isoformat()
+        for v in (daily_version, feature_version)
+    )
+    confidence = None if confidence is None or pd.isna(confidence) else round(float(confidence), 4)
+    key = (f"{city}|{days}|{model_type}|{models.get('version')}|{date.today()}|"
+           f"{daily_version}|{feature_version}|{predicted_risk}|{confidence}")
+    # Weak, because GZipMiddleware sends the same tag on gzip and identity bodies
+    return 'W/"' + hashlib.sha256(key.encode()).hexdigest()[:32] + '"'
+
+
+def etag_matches(request, etag):
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    # If-None-Match uses weak comparison, so ignore any W/ prefix
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag.removeprefix("W/") in candidates
+
+
+@app.get("/dashboard", response_model=DashboardResponse)
+async def get_dashboard(
+    request: Request,
+    city: str = Query(..., description="City name"),
+    days: int = Query(30, ge=1, le=365, description="Number of days of history (1-365)"),
+    model_type: Optional[str] = Query("xgboost", description="Model type: xgboost or logistic")
+):
+    if 'model_type' not in models:
+        raise HTTPException(status_code=503, detail="Models not loaded. Run train.py first.")
+    
+    if model_type not in models and model_type != models.get('model_type'):
+        model_type = models.get('model_type', 'xgboost')
+    
+    loop = asyncio.get_running_loop()
+    cache_headers = {"Cache-Control": "private, no-cache"}
+    
+    try:
+        version = await loop.run_in_executor(None, read_city_version, city, days)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reading data version: {str(e)}")
+    
+    etag = make_etag(city, days, model_type, version)
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={**cache_headers, "ETag": etag})
+    
+    risk = await run_coalesced(('risk', city, model_type), compute_risk, city, model_type)
+    history = await loop.run_in_executor(None, compute_history, city, days)
+    
+    # Scoring has just written today's prediction to the primary, which the replica
+    # may not have yet, so it is merged into the history from the response
+    for entry in history.entries:
+        if entry.date == risk.date:
+            entry.predicted_risk = risk.risk
+            entry.confidence = risk.confidence
+    
+    # Tagged with what was actually returned rather than read back. If the replica
+    # is behind any of it, the next request's version will not match and that
+    # request is recomputed instead of revalidating stale data.
+    etag = make_etag(city, days, model_type, (history._daily_version, risk._feature_version, risk.risk, risk.confidence))
+    
+    dashboard = DashboardResponse(risk=risk, history=history)
+    return JSONResponse(content=dashboard.model_dump(), headers={**cache_headers, "ETag": etag})
+
+
+def compute_drift_report():
+    reference = load_snapshot(os.path.join("models", "feature_stats.json"))
+    daily = load_window_stats(os.path.join(stats_dir, "daily_stats.json"))
+    raw = load_window_stats(os.path.join(stats_dir, "raw_stats.json"))
+    return {
+        'model_version': models.get('version'),
+        'features': compare_stats(daily, reference) if reference else None,
+        'raw': {field: stats.summary() for field, stats in raw.items()}
+    }
+
+
+@app.get("/drift")
+async def get_drift():
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, compute_drift_report)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error computing drift report: {str(e)}")
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
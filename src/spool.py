@@ -0,0 +1,149 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+# Durable append-only queue for ingested readings, backed by SQLite in WAL mode.
+# Readings survive a crash or a database outage and are drained in batches by
+# flush(); anything still pending is replayed by the next flush after a restart.
+# The same file keeps the last fetch time per city, recently ingested observation
+# keys and the cities whose location is stored, so one-shot ingest runs can skip
+# redundant fetches and writes.
+class IngestSpool:
+    def __init__(self, path="spool/ingest.db"):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS spool (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                spooled_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS fetches (
+                city TEXT PRIMARY KEY,
+                fetched_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS observations (
+                city TEXT NOT NULL,
+                ts TEXT NOT NULL,
+                seen_at REAL NOT NULL,
+                PRIMARY KEY (city, ts)
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS stored_locations (
+                city TEXT PRIMARY KEY
+            )
+        """)
+        self._conn.commit()
+
+    def append(self, record):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO spool (payload, spooled_at) VALUES (?, ?)",
+                (json.dumps(record), time.time())
+            )
+            self._conn.commit()
+
+    def pending(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+
+    def flush(self, write_batch, batch_size=1000):
+        # write_batch(records) must persist the whole batch or raise; rows are only
+        # removed from the spool after it returns, so a failure leaves them queued.
+        flushed = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    rows = self._conn.execute(
+                        "SELECT id, payload FROM spool ORDER BY id LIMIT ?", (batch_size,)
+                    ).fetchall()
+                if not rows:
+                    return flushed
+
+                write_batch([json.loads(payload) for _, payload in rows])
+
+                with self._lock:
+                    self._conn.execute("DELETE FROM spool WHERE id <= ?", (rows[-1][0],))
+                    self._conn.commit()
+                flushed += len(rows)
+
+    def last_fetch(self, city):
+        with self._lock:
+            row = self._conn.execute("SELECT fetched_at FROM fetches WHERE city = ?", (city,)).fetchone()
+        return row[0] if row else None
+
+    def record_fetch(self, city):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO fetches (city, fetched_at) VALUES (?, ?)", (city, time.time())
+            )
+            self._conn.commit()
+
+    def has_observation(self, city, ts):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM observations WHERE city = ? AND ts = ?", (city, ts)
+            ).fetchone() is not None
+
+    def remember_observation(self, city, ts, limit=10000):
+        # Only the `limit` most recently seen keys are kept
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO observations (city, ts, seen_at) VALUES (?, ?, ?)",
+                (city, ts, time.time())
+            )
+            self._conn.execute("""
+                DELETE FROM observations WHERE rowid IN (
+                    SELECT rowid FROM observations ORDER BY seen_at DESC LIMIT -1 OFFSET ?
+                )
+            """, (limit,))
+            self._conn.commit()
+
+    def has_location(self, city):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM stored_locations WHERE city = ?", (city,)
+            ).fetchone() is not None
+
+    def remember_location(self, city):
+        with self._lock:
+            self._conn.execute("INSERT OR IGNORE INTO stored_locations (city) VALUES (?)", (city,))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SpoolFlusher(threading.Thread):
+    def __init__(self, flush, interval=5.0):
+        super().__init__(daemon=True)
+        self._flush = flush
+        self._interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self._interval):
+            self._flush()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        # Final drain so nothing spooled during the last interval is left behind
+        self._flush()
@@ -2,14 +2,28 @@ import pandas as pd
 from sqlalchemy import create_engine, text
 from dotenv import dotenv_values
 import joblib
+import json
 import os
-from sklearn.model_selection import train_test_split
+import time
+import itertools
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from sklearn.model_selection import train_test_split, StratifiedKFold
 from sklearn.linear_model import LogisticRegression
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import accuracy_score, classification_report, confusion_matrix
 import xgboost as xgb
 import numpy as np
 
+try:
+    from src.features import BASE_FEATURES, FEATURE_COLUMNS, fill_missing_rolling_features
+    from src.drift import snapshot_frame, stats_to_dict, write_json_atomic
+    from src import profiling
+except ImportError:
+    from features import BASE_FEATURES, FEATURE_COLUMNS, fill_missing_rolling_features
+    from drift import snapshot_frame, stats_to_dict, write_json_atomic
+    import profiling
+
 env = dotenv_values(".env")
 
 if not env:
@@ -20,6 +34,17 @@ db_password = env.get("DB_PASSWORD")
 db_host = env.get("DB_HOST")
 db_name = env.get("DB_NAME")
 
+XGBOOST_PARAM_GRID = {
+    'max_depth': [2, 3, 4, 6],
+    'learning_rate': [0.05, 0.1, 0.3],
+    'min_child_weight': [1, 5]
+}
+LOGISTIC_PARAM_GRID = {
+    'C': [0.01, 0.1, 1.0, 10.0]
+}
+MAX_BOOSTING_ROUNDS = 500
+EARLY_STOPPING_ROUNDS = 20
+
 
 def load_training_data(engine=None):
     if engine is None:
@@ -29,18 +54,22 @@ def load_training_data(engine=None):
     
     try:
         print("Loading training data from database...")
-        df = pd.read_sql(text("SELECT * FROM weather_daily"), engine)
+        with profiling.stage("read_training_data"):
+            df = pd.read_sql(text("SELECT * FROM weather_daily"), engine)
+        profiling.count("rows_read", len(df))
         
         if df.empty:
             raise ValueError("No training data found in weather_daily table. Run features.py first.")
         
-        feature_cols = ['min_temp_c', 'avg_temp_c', 'wind_speed', 'humidity', 'wind_chill', 'mean_aqi']
+        feature_cols = FEATURE_COLUMNS
         
-        missing_cols = [col for col in feature_cols if col not in df.columns]
+        missing_cols = [col for col in BASE_FEATURES if col not in df.columns]
         if missing_cols:
             raise ValueError(f"Missing required columns: {missing_cols}")
         
-        df = df.dropna(subset=feature_cols + ['risk_level'])
+        with profiling.stage("clean_training_data"):
+            df = df.dropna(subset=BASE_FEATURES + ['risk_level'])
+            df = fill_missing_rolling_features(df)
         
         if df.empty:
             raise ValueError("No valid training data after cleaning.")
@@ -69,8 +98,9 @@ def load_training_data(engine=None):
         raise
 
 
-def train_logistic_regression(X, y, class_names):
+def train_logistic_regression(X, y, class_names, params=None):
     print("\nTraining Logistic Regression model...")
+    params = params or {}
     
     X_train, X_test, y_train, y_test = train_test_split(
         X, y, test_size=0.2, random_state=42, stratify=y
@@ -82,6 +112,7 @@ def train_logistic_regression(X, y, class_names):
     
     model = LogisticRegression(
         solver='lbfgs',
+        C=params.get('C', 1.0),
         max_iter=1000,
         random_state=42
     )
@@ -96,8 +127,9 @@ def train_logistic_regression(X, y, class_names):
     return model, scaler
 
 
-def train_xgboost(X, y, class_names):
+def train_xgboost(X, y, class_names, params=None):
     print("\nTraining XGBoost model...")
+    params = params or {}
     
     X_train, X_test, y_train, y_test = train_test_split(
         X, y, test_size=0.2, random_state=42, stratify=y
@@ -108,9 +140,10 @@ def train_xgboost(X, y, class_names):
     if num_classes == 2:
         model = xgb.XGBClassifier(
             objective='binary:logistic',
-            max_depth=6,
-            learning_rate=0.1,
-            n_estimators=100,
+            max_depth=params.get('max_depth', 6),
+            learning_rate=params.get('learning_rate', 0.1),
+            n_estimators=params.get('n_estimators', 100),
+            min_child_weight=params.get('min_child_weight', 1),
             random_state=42,
             eval_metric='logloss'
         )
@@ -118,9 +151,10 @@ def train_xgboost(X, y, class_names):
         model = xgb.XGBClassifier(
             objective='multi:softprob',
             num_class=num_classes,
-            max_depth=6,
-            learning_rate=0.1,
-            n_estimators=100,
+            max_depth=params.get('max_depth', 6),
+            learning_rate=params.get('learning_rate', 0.1),
+            n_estimators=params.get('n_estimators', 100),
+            min_child_weight=params.get('min_child_weight', 1),
             random_state=42,
             eval_metric='mlogloss'
         )
@@ -135,26 +169,226 @@ def train_xgboost(X, y, class_names):
     return model
 
 
-def save_models(logistic_model, scaler, xgboost_model, risk_mapping, model_dir="models"):
+# Fold datasets are built once in the parent and handed to each worker process
+# once through the pool initializer; DMatrix objects are cached per worker.
+_tuning_folds = None
+_tuning_dmatrices = {}
+
+
+def build_cv_folds(X, y, n_splits=5):
+    min_class_count = int(y.value_counts().min())
+    n_splits = min(n_splits, min_class_count)
+    if n_splits < 2:
+        raise ValueError(f"Need at least 2 samples per risk level for cross-validation. Smallest class has {min_class_count}.")
+    
+    X_values = X.to_numpy(dtype=float)
+    y_values = y.to_numpy()
+    num_classes = len(np.unique(y_values))
+    
+    folds = []
+    splitter = StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=42)
+    for train_idx, valid_idx in splitter.split(X_values, y_values):
+        scaler = StandardScaler().fit(X_values[train_idx])
+        folds.append({
+            'X_train': X_values[train_idx],
+            'y_train': y_values[train_idx],
+            'X_valid': X_values[valid_idx],
+            'y_valid': y_values[valid_idx],
+            'X_train_scaled': scaler.transform(X_values[train_idx]),
+            'X_valid_scaled': scaler.transform(X_values[valid_idx]),
+            'num_classes': num_classes
+        })
+    return folds
+
+
+def _init_tuning_worker(folds):
+    global _tuning_folds, _tuning_dmatrices
+    _tuning_folds = folds
+    _tuning_dmatrices = {}
+
+
+def _fold_dmatrices(fold_idx):
+    if fold_idx not in _tuning_dmatrices:
+        fold = _tuning_folds[fold_idx]
+        _tuning_dmatrices[fold_idx] = (
+            xgb.DMatrix(fold['X_train'], label=fold['y_train']),
+            xgb.DMatrix(fold['X_valid'], label=fold['y_valid'])
+        )
+    return _tuning_dmatrices[fold_idx]
+
+
+def run_xgboost_trial(params):
+    start = time.perf_counter()
+    scores = []
+    rounds = []
+    predict_seconds = 0.0
+    predict_rows = 0
+    
+    for fold_idx, fold in enumerate(_tuning_folds):
+        dtrain, dvalid = _fold_dmatrices(fold_idx)
+        booster_params = {
+            'max_depth': params['max_depth'],
+            'eta': params['learning_rate'],
+            'min_child_weight': params['min_child_weight'],
+            'seed': 42,
+            'nthread': 1
+        }
+        if fold['num_classes'] == 2:
+            booster_params.update(objective='binary:logistic', eval_metric='logloss')
+        else:
+            booster_params.update(objective='multi:softprob', num_class=fold['num_classes'], eval_metric='mlogloss')
+        
+        # The validation fold drives early stopping, so each trial only pays for useful rounds
+        booster = xgb.train(
+            booster_params,
+            dtrain,
+            num_boost_round=MAX_BOOSTING_ROUNDS,
+            evals=[(dvalid, 'valid')],
+            early_stopping_rounds=EARLY_STOPPING_ROUNDS,
+            verbose_eval=False
+        )
+        n_rounds = booster.best_iteration + 1
+        
+        predict_start = time.perf_counter()
+        proba = booster.predict(dvalid, iteration_range=(0, n_rounds))
+        predict_seconds += time.perf_counter() - predict_start
+        predict_rows += len(fold['y_valid'])
+        
+        y_pred = (proba > 0.5).astype(int) if proba.ndim == 1 else np.argmax(proba, axis=1)
+        scores.append(accuracy_score(fold['y_valid'], y_pred))
+        rounds.append(n_rounds)
+    
+    n_estimators = int(np.ceil(np.mean(rounds)))
+    return {
+        'model': 'xgboost',
+        'params': {**params, 'n_estimators': n_estimators},
+        'score': float(np.mean(scores)),
+        'score_std': float(np.std(scores)),
+        'complexity': n_estimators * 2 ** params['max_depth'],
+        'fit_seconds': time.perf_counter() - start,
+        'predict_us_per_row': 1e6 * predict_seconds / max(predict_rows, 1)
+    }
+
+
+def run_logistic_trial(params):
+    start = time.perf_counter()
+    scores = []
+    predict_seconds = 0.0
+    predict_rows = 0
+    
+    for fold in _tuning_folds:
+        model = LogisticRegression(solver='lbfgs', C=params['C'], max_iter=1000, random_state=42)
+        model.fit(fold['X_train_scaled'], fold['y_train'])
+        
+        predict_start = time.perf_counter()
+        y_pred = model.predict(fold['X_valid_scaled'])
+        predict_seconds += time.perf_counter() - predict_start
+        predict_rows += len(fold['y_valid'])
+        
+        scores.append(accuracy_score(fold['y_valid'], y_pred))
+    
+    return {
+        'model': 'logistic',
+        'params': dict(params),
+        'score': float(np.mean(scores)),
+        'score_std': float(np.std(scores)),
+        'complexity': 0,
+        'fit_seconds': time.perf_counter() - start,
+        'predict_us_per_row': 1e6 * predict_seconds / max(predict_rows, 1)
+    }
+
+
+def expand_grid(grid):
+    keys = sorted(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+
+def select_trial(trials, min_accuracy=None, tolerance=0.01):
+    # Cheapest model that clears the accuracy bar; without an explicit bar, accept
+    # anything within `tolerance` of the best cross-validated score. Equally cheap
+    # trials (e.g. all logistic ones) are ranked by score, not by timing noise.
+    best_score = max(t['score'] for t in trials)
+    bar = min_accuracy if min_accuracy is not None else best_score - tolerance
+    eligible = [t for t in trials if t['score'] >= bar]
+    if not eligible:
+        print(f"No trial reached accuracy {bar:.4f}; using the best scoring trial.")
+        eligible = [t for t in trials if t['score'] == best_score]
+    return min(eligible, key=lambda t: (t['complexity'], -t['score']))
+
+
+def tune_models(X, y, n_workers=None, min_accuracy=None, n_splits=5):
+    print("\nTuning hyperparameters with cross-validation...")
+    folds = build_cv_folds(X, y, n_splits)
+    
+    xgboost_grid = expand_grid(XGBOOST_PARAM_GRID)
+    logistic_grid = expand_grid(LOGISTIC_PARAM_GRID)
+    
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_tuning_worker, initargs=(folds,)) as pool:
+        xgboost_trials = list(pool.map(run_xgboost_trial, xgboost_grid))
+        logistic_trials = list(pool.map(run_logistic_trial, logistic_grid))
+    elapsed = time.perf_counter() - start
+    
+    for trial in sorted(xgboost_trials + logistic_trials, key=lambda t: -t['score']):
+        print(f"{trial['model']:<9} {trial['params']} score={trial['score']:.4f} "
+              f"fit={trial['fit_seconds']:.2f}s predict={trial['predict_us_per_row']:.1f}us/row")
+    
+    best_xgboost = select_trial(xgboost_trials, min_accuracy)
+    best_logistic = select_trial(logistic_trials, min_accuracy)
+    print(f"\nSelected XGBoost params: {best_xgboost['params']} (score {best_xgboost['score']:.4f})")
+    print(f"Selected Logistic Regression params: {best_logistic['params']} (score {best_logistic['score']:.4f})")
+    
+    report = {
+        'n_folds': len(folds),
+        'min_accuracy': min_accuracy,
+        'search_seconds': elapsed,
+        'selected': {'xgboost': best_xgboost, 'logistic': best_logistic},
+        'trials': xgboost_trials + logistic_trials
+    }
+    return best_xgboost['params'], best_logistic['params'], report
+
+
+def dump_atomic(obj, path):
+    # Write next to the target and rename, so readers never see a partial file
+    tmp_path = f"{path}.tmp"
+    joblib.dump(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def save_models(logistic_model, scaler, xgboost_model, risk_mapping, feature_names=None, training_stats=None,
+                model_dir="models"):
     os.makedirs(model_dir, exist_ok=True)
     
-    joblib.dump(logistic_model, os.path.join(model_dir, "logistic_regression.joblib"))
-    joblib.dump(scaler, os.path.join(model_dir, "scaler.joblib"))
+    dump_atomic(logistic_model, os.path.join(model_dir, "logistic_regression.joblib"))
+    dump_atomic(scaler, os.path.join(model_dir, "scaler.joblib"))
     print(f"\nSaved Logistic Regression model to {model_dir}/logistic_regression.joblib")
     print(f"Saved scaler to {model_dir}/scaler.joblib")
     
-    joblib.dump(xgboost_model, os.path.join(model_dir, "xgboost.joblib"))
+    dump_atomic(xgboost_model, os.path.join(model_dir, "xgboost.joblib"))
     print(f"Saved XGBoost model to {model_dir}/xgboost.joblib")
     
-    joblib.dump(risk_mapping, os.path.join(model_dir, "risk_mapping.joblib"))
+    dump_atomic(risk_mapping, os.path.join(model_dir, "risk_mapping.joblib"))
     print(f"Saved risk mapping to {model_dir}/risk_mapping.joblib")
     
-    feature_names = ['min_temp_c', 'avg_temp_c', 'wind_speed', 'humidity', 'wind_chill', 'mean_aqi']
-    joblib.dump(feature_names, os.path.join(model_dir, "feature_names.joblib"))
+    if feature_names is None:
+        feature_names = FEATURE_COLUMNS
+    dump_atomic(list(feature_names), os.path.join(model_dir, "feature_names.joblib"))
     print(f"Saved feature names to {model_dir}/feature_names.joblib")
+    
+    if training_stats is not None:
+        write_json_atomic(stats_to_dict(training_stats), os.path.join(model_dir, "feature_stats.json"))
+        print(f"Saved training feature statistics to {model_dir}/feature_stats.json")
+    
+    # Written last: running API workers reload once this changes
+    version = time.strftime("%Y%m%d%H%M%S")
+    version_path = os.path.join(model_dir, "VERSION")
+    with open(f"{version_path}.tmp", "w") as f:
+        f.write(version)
+    os.replace(f"{version_path}.tmp", version_path)
+    print(f"Saved model version {version} to {model_dir}/VERSION")
 
 
-def train_models():
+def train_models(tune=False, n_workers=None, min_accuracy=None):
     try:
         if not all([db_user, db_password, db_host, db_name]):
             raise ValueError("Database credentials are required. Set DB_USER, DB_PASSWORD, DB_HOST, DB_NAME in .env")
@@ -164,12 +398,30 @@ def train_models():
         # Load training data
         X, y, risk_mapping, class_names = load_training_data(engine)
         
+        xgboost_params = None
+        logistic_params = None
+        profiling.count("rows_trained", len(X))
+        if tune:
+            # Trials run in worker processes: CPU time and memory here cover the parent only
+            with profiling.stage("tune"):
+                xgboost_params, logistic_params, report = tune_models(X, y, n_workers, min_accuracy)
+        
         # Train models
-        logistic_model, scaler = train_logistic_regression(X, y, class_names)
-        xgboost_model = train_xgboost(X, y, class_names)
+        with profiling.stage("train_logistic"):
+            logistic_model, scaler = train_logistic_regression(X, y, class_names, logistic_params)
+        with profiling.stage("train_xgboost"):
+            xgboost_model = train_xgboost(X, y, class_names, xgboost_params)
         
         # Save models
-        save_models(logistic_model, scaler, xgboost_model, risk_mapping)
+        with profiling.stage("training_stats"):
+            training_stats = snapshot_frame(X, list(X.columns))
+        with profiling.stage("save"):
+            save_models(logistic_model, scaler, xgboost_model, risk_mapping, list(X.columns), training_stats)
+        if tune:
+            report_path = os.path.join("models", "tuning_report.json")
+            with open(report_path, "w") as f:
+                json.dump(report, f, indent=2)
+            print(f"Saved tuning report to {report_path}")
         
         print("\nModel training completed successfully!")
         return True
@@ -180,5 +432,18 @@ def train_models():
 
 
 if __name__ == "__main__":
-    train_models()
+    parser = argparse.ArgumentParser(description="Train ClimaGuard risk models")
+    parser.add_argument("--tune", action="store_true", help="Run a cross-validated hyperparameter search before training")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for --tune (default: CPU count)")
+    parser.add_argument("--min-accuracy", type=float, default=None,
+                        help="Accuracy bar for --tune; the cheapest model reaching it is selected")
+    profiling.add_profile_arguments(parser)
+    args = parser.parse_args()
+    
+    if args.profile is not None:
+        profiling.start("train", args.cprofile_dir)
+    try:
+        train_models(tune=args.tune, n_workers=args.workers, min_accuracy=args.min_accuracy)
+    finally:
+        profiling.finish(args.profile or None)
 